@@ -0,0 +1,2 @@
+# Importing the src package puts src/data and src/visualization on the path, as for `python -m src.<module>`
+import src  # noqa: F401
@@ -0,0 +1,9 @@
+import sys
+from pathlib import Path
+
+# The modules in data and visualization import each other by name. Running any script as
+# `python -m src.<module>` from the project root imports this package first, which puts both
+# folders on the path once for every entry point
+for folder in ("data", "visualization"):
+    if (path := str(Path(__file__).resolve().parent / folder)) not in sys.path:
+        sys.path.append(path)
@@ -0,0 +1,201 @@
+import numpy as np
+
+# sRGB (D65) -> CIE XYZ
+_RGB_TO_XYZ: np.ndarray = np.array(
+    [
+        [0.4124564, 0.3575761, 0.1804375],
+        [0.2126729, 0.7151522, 0.0721750],
+        [0.0193339, 0.1191920, 0.9503041],
+    ],
+    dtype=np.float32,
+)
+_XYZ_TO_RGB: np.ndarray = np.linalg.inv(_RGB_TO_XYZ).astype(np.float32)
+_D65_WHITE: np.ndarray = np.array([0.95047, 1.0, 1.08883], dtype=np.float32)
+
+# Linear sRGB -> cone responses -> OKLab, from Björn Ottosson's OKLab definition
+_RGB_TO_LMS: np.ndarray = np.array(
+    [
+        [0.4122214708, 0.5363325363, 0.0514459929],
+        [0.2119034982, 0.6806995451, 0.1073969566],
+        [0.0883024619, 0.2817188376, 0.6299787005],
+    ],
+    dtype=np.float32,
+)
+_LMS_TO_OKLAB: np.ndarray = np.array(
+    [
+        [0.2104542553, 0.7936177850, -0.0040720468],
+        [1.9779984951, -2.4285922050, 0.4505937099],
+        [0.0259040371, 0.7827717662, -0.8086757660],
+    ],
+    dtype=np.float32,
+)
+_OKLAB_TO_LMS: np.ndarray = np.array(
+    [
+        [1.0, 0.3963377774, 0.2158037573],
+        [1.0, -0.1055613458, -0.0638541728],
+        [1.0, -0.0894841775, -1.2914855480],
+    ],
+    dtype=np.float32,
+)
+_LMS_TO_RGB: np.ndarray = np.array(
+    [
+        [4.0767416621, -3.3077115913, 0.2309699292],
+        [-1.2684380046, 2.6097574011, -0.3413193965],
+        [-0.0041960863, -0.7034186147, 1.7076147010],
+    ],
+    dtype=np.float32,
+)
+
+
+def srgb_to_linear(rgb: np.ndarray) -> np.ndarray:
+    """
+    srgb_to_linear Undo the sRGB transfer curve
+
+    Args:
+        `rgb (np.ndarray)`: `(..., 3)` array of sRGB values in [0, 255]
+
+    Returns:
+        `np.ndarray`: `(..., 3)` float32 array of linear RGB values in [0, 1]
+    """
+    rgb = np.asarray(rgb)
+    if rgb.dtype == np.uint8:
+        # A table lookup is much cheaper than the power curve for every pixel
+        return _LINEAR_LUT[rgb]
+    c: np.ndarray = rgb.astype(np.float32) / 255
+    return np.where(c <= 0.04045, c / 12.92, ((c + 0.055) / 1.055) ** 2.4)
+
+
+_LINEAR_LUT: np.ndarray = srgb_to_linear(np.arange(256, dtype=np.float32))
+
+
+def linear_to_srgb(linear: np.ndarray) -> np.ndarray:
+    """
+    linear_to_srgb Apply the sRGB transfer curve, clipping colors outside the gamut
+
+    Args:
+        `linear (np.ndarray)`: `(..., 3)` array of linear RGB values in [0, 1]
+
+    Returns:
+        `np.ndarray`: `(..., 3)` float32 array of sRGB values in [0, 255]
+    """
+    c: np.ndarray = np.clip(np.asarray(linear, dtype=np.float32), 0, 1)
+    return 255 * np.where(c <= 0.0031308, 12.92 * c, 1.055 * c ** (1 / 2.4) - 0.055)
+
+
+def srgb_to_lab(rgb: np.ndarray) -> np.ndarray:
+    """
+    srgb_to_lab Convert sRGB colors to CIELAB (D65)
+
+    Args:
+        `rgb (np.ndarray)`: `(..., 3)` array of sRGB values in [0, 255]
+
+    Returns:
+        `np.ndarray`: `(..., 3)` float32 array of L*, a*, b* values
+    """
+    xyz: np.ndarray = srgb_to_linear(rgb) @ _RGB_TO_XYZ.T / _D65_WHITE
+    f: np.ndarray = np.where(
+        xyz > (6 / 29) ** 3, np.cbrt(xyz), xyz / (3 * (6 / 29) ** 2) + 4 / 29
+    )
+    return np.stack(
+        [
+            116 * f[..., 1] - 16,
+            500 * (f[..., 0] - f[..., 1]),
+            200 * (f[..., 1] - f[..., 2]),
+        ],
+        axis=-1,
+    ).astype(np.float32)
+
+
+def lab_to_srgb(lab: np.ndarray) -> np.ndarray:
+    """
+    lab_to_srgb Convert CIELAB (D65) colors back to sRGB
+
+    Args:
+        `lab (np.ndarray)`: `(..., 3)` array of L*, a*, b* values
+
+    Returns:
+        `np.ndarray`: `(..., 3)` float32 array of sRGB values in [0, 255]
+    """
+    lab = np.asarray(lab, dtype=np.float32)
+    fy: np.ndarray = (lab[..., 0] + 16) / 116
+    f: np.ndarray = np.stack([fy + lab[..., 1] / 500, fy, fy - lab[..., 2] / 200], axis=-1)
+    xyz: np.ndarray = np.where(f > 6 / 29, f**3, 3 * (6 / 29) ** 2 * (f - 4 / 29))
+    return linear_to_srgb((xyz * _D65_WHITE) @ _XYZ_TO_RGB.T)
+
+
+def srgb_to_oklab(rgb: np.ndarray) -> np.ndarray:
+    """
+    srgb_to_oklab Convert sRGB colors to OKLab
+
+    Args:
+        `rgb (np.ndarray)`: `(..., 3)` array of sRGB values in [0, 255]
+
+    Returns:
+        `np.ndarray`: `(..., 3)` float32 array of L, a, b values. L is in [0, 1]
+    """
+    lms: np.ndarray = srgb_to_linear(rgb) @ _RGB_TO_LMS.T
+    return (np.cbrt(lms) @ _LMS_TO_OKLAB.T).astype(np.float32)
+
+
+def oklab_to_srgb(oklab: np.ndarray) -> np.ndarray:
+    """
+    oklab_to_srgb Convert OKLab colors back to sRGB
+
+    Args:
+        `oklab (np.ndarray)`: `(..., 3)` array of L, a, b values
+
+    Returns:
+        `np.ndarray`: `(..., 3)` float32 array of sRGB values in [0, 255]
+    """
+    lms: np.ndarray = (np.asarray(oklab, dtype=np.float32) @ _OKLAB_TO_LMS.T) ** 3
+    return linear_to_srgb(lms @ _LMS_TO_RGB.T)
+
+
+# Forward and inverse conversion from sRGB in [0, 255] for each color space
+COLOR_SPACES: dict[str, tuple] = {
+    "rgb": (lambda rgb: np.asarray(rgb, dtype=np.float32), lambda rgb: rgb),
+    "lab": (srgb_to_lab, lab_to_srgb),
+    "oklab": (srgb_to_oklab, oklab_to_srgb),
+}
+
+
+def to_color_space(rgb: np.ndarray, color_space: str) -> np.ndarray:
+    """
+    to_color_space Convert sRGB colors to one of `COLOR_SPACES`
+
+    Args:
+        `rgb (np.ndarray)`: `(..., 3)` array of sRGB values in [0, 255]
+        `color_space (str)`: `rgb`, `lab` or `oklab`
+
+    Returns:
+        `np.ndarray`: `(..., 3)` float32 array
+    """
+    return COLOR_SPACES[color_space][0](rgb)
+
+
+def from_color_space(colors: np.ndarray, color_space: str) -> np.ndarray:
+    """
+    from_color_space Convert colors in one of `COLOR_SPACES` back to sRGB
+
+    Args:
+        `colors (np.ndarray)`: `(..., 3)` array in `color_space`
+        `color_space (str)`: `rgb`, `lab` or `oklab`
+
+    Returns:
+        `np.ndarray`: `(..., 3)` array of sRGB values in [0, 255]
+    """
+    return COLOR_SPACES[color_space][1](colors)
+
+
+def delta_e(rgb_1: np.ndarray, rgb_2: np.ndarray) -> np.ndarray:
+    """
+    delta_e CIE76 color difference between two sets of sRGB colors
+
+    Args:
+        `rgb_1 (np.ndarray)`: `(..., 3)` array of sRGB values in [0, 255]
+        `rgb_2 (np.ndarray)`: `(..., 3)` array of sRGB values in [0, 255]
+
+    Returns:
+        `np.ndarray`: ΔE for each pair of colors. A ΔE below ~2.3 is not noticeable
+    """
+    return np.linalg.norm(srgb_to_lab(rgb_1) - srgb_to_lab(rgb_2), axis=-1)
@@ -0,0 +1,225 @@
+import json
+from pathlib import Path
+
+import color_conversion as cc
+import cover_index as ci
+import kmeans as km  # noqa: F401 Patches scikit-learn before KMeans is imported
+import numpy as np
+import palette_cache as pc
+import palette_store as ps
+import polars as pl
+from scipy.spatial import cKDTree
+from sklearn.cluster import KMeans
+
+DEFAULT_GLOBAL_COLORS: int = 24
+
+
+class ColorIndex:
+    """
+    ColorIndex Corpus-wide palette and nearest-color index over the per-cover centroids
+
+    Every centroid of every cover is converted to CIELAB, where Euclidean distance is the CIE76
+    ΔE, and indexed in a KD-tree. A weighted k-means over the same centroids gives the global
+    palette, a shared color vocabulary, and each cover is summarized as the share of its pixels
+    in each global color.
+
+    Args:
+        `palettes (pl.DataFrame)`: Rows following `palette_store.PALETTE_SCHEMA`, one per cover
+        `n_colors (int)`: Number of global colors
+        `random_state (int | None)`: Seed for the global k-means
+    """
+
+    def __init__(
+        self,
+        palettes: pl.DataFrame,
+        n_colors: int = DEFAULT_GLOBAL_COLORS,
+        random_state: int | None = 0,
+    ) -> None:
+        palettes = palettes.sort("year", "month").with_row_index("cover")
+        self.covers: pl.DataFrame = palettes.select("cover", "filename", "year", "month")
+        centroids: pl.DataFrame = palettes.select(
+            "cover", "centroids", "proportions"
+        ).explode("centroids", "proportions")
+
+        self.centroid_cover: np.ndarray = centroids.get_column("cover").to_numpy()
+        self.centroid_rgb: np.ndarray = centroids.get_column("centroids").to_numpy()
+        self.centroid_proportion: np.ndarray = centroids.get_column("proportions").to_numpy()
+        self.centroid_lab: np.ndarray = cc.srgb_to_lab(self.centroid_rgb)
+        self.colors_per_cover: int = int(
+            palettes.get_column("centroids").list.len().max() or 0
+        )
+        self.tree: cKDTree = cKDTree(self.centroid_lab)
+
+        n_colors = min(n_colors, len(self.centroid_lab))
+        kmeans: KMeans = KMeans(
+            n_clusters=n_colors, n_init="auto", random_state=random_state
+        ).fit(self.centroid_lab, sample_weight=self.centroid_proportion)
+        # Number the global colors from the most to the least used across the archive
+        shares: np.ndarray = np.bincount(
+            kmeans.labels_, weights=self.centroid_proportion, minlength=n_colors
+        )
+        order: np.ndarray = np.argsort(-shares, kind="stable")
+        rank: np.ndarray = np.empty(n_colors, dtype=np.int64)
+        rank[order] = np.arange(n_colors)
+
+        self.global_lab: np.ndarray = kmeans.cluster_centers_[order].astype(np.float32)
+        self.global_rgb: np.ndarray = cc.lab_to_srgb(self.global_lab)
+        self.centroid_global: np.ndarray = rank[kmeans.labels_]
+        # Share of each cover in each global color, (n_covers, n_colors)
+        self.cover_histograms: np.ndarray = np.zeros(
+            (self.covers.height, n_colors), dtype=np.float32
+        )
+        np.add.at(
+            self.cover_histograms,
+            (self.centroid_cover, self.centroid_global),
+            self.centroid_proportion,
+        )
+        self._rows: dict[str, int] = {
+            filename: row for row, filename in enumerate(self.covers.get_column("filename"))
+        }
+
+    @classmethod
+    def from_store(
+        cls,
+        folder: Path = ci.PALETTE_FILEPATH,
+        kmeans_params: dict | None = None,
+        **kwargs,
+    ) -> "ColorIndex":
+        """
+        from_store Build the index from the palettes stored by the pipeline
+
+        Args:
+            `folder (Path)`: Palette store folder
+            `kmeans_params (dict | None)`: Parameters the palettes were fitted with. Defaults to 10 clusters with the other defaults of `kmeans_img`
+            `**kwargs`: Keyword arguments for `ColorIndex`
+
+        Returns:
+            `ColorIndex`: Index over every cover fitted with `kmeans_params`
+        """
+        kmeans_params = pc.normalize_params(kmeans_params or {"n_clusters": 10})
+        palettes: pl.DataFrame = pl.DataFrame(schema=ps.PALETTE_SCHEMA)
+        if any(folder.glob("part-*.parquet")):
+            palettes = (
+                ps.scan_palettes(folder)
+                .filter(pl.col("kmeans_params") == json.dumps(kmeans_params, sort_keys=True))
+                .collect()
+            )
+        if palettes.is_empty():
+            raise ValueError(f"No palettes fitted with {kmeans_params} in {folder}")
+        return cls(palettes, **kwargs)
+
+    def nearest_covers(
+        self,
+        color: np.ndarray,
+        k: int = 10,
+        max_delta_e: float | None = None,
+        min_proportion: float = 0.0,
+    ) -> pl.DataFrame:
+        """
+        nearest_covers Find the covers with a centroid closest to a color
+
+        Args:
+            `color (np.ndarray)`: sRGB color in [0, 255]
+            `k (int)`: Maximum number of covers
+            `max_delta_e (float | None)`: Only match centroids within this ΔE
+            `min_proportion (float)`: Only match centroids covering at least this share of their cover
+
+        Returns:
+            `pl.DataFrame`: filename, year, month, the matched centroid, its proportion and ΔE, closest first, one row per cover
+        """
+        lab: np.ndarray = cc.srgb_to_lab(np.asarray(color, dtype=np.float32))
+        n_centroids: int = len(self.centroid_lab)
+        n_neighbors: int = min(n_centroids, max(k * self.colors_per_cover, 1))
+        while True:
+            distances, indices = self.tree.query(
+                lab,
+                k=n_neighbors,
+                distance_upper_bound=np.inf if max_delta_e is None else max_delta_e,
+            )
+            distances, indices = np.atleast_1d(distances), np.atleast_1d(indices)
+            found: np.ndarray = indices < n_centroids
+            distances, indices = distances[found], indices[found]
+            keep: np.ndarray = self.centroid_proportion[indices] >= min_proportion
+            distances, indices = distances[keep], indices[keep]
+            # The nearest centroid of each cover, in order of distance
+            _, first = np.unique(self.centroid_cover[indices], return_index=True)
+            first = np.sort(first)[:k]
+            # Widen the search when filtered centroids left fewer than k covers
+            if len(first) >= k or n_neighbors == n_centroids or not found.all():
+                break
+            n_neighbors = min(n_centroids, 2 * n_neighbors)
+
+        indices = indices[first]
+        return self.covers[self.centroid_cover[indices]].select(
+            "filename", "year", "month"
+        ).with_columns(
+            color=pl.Series(self.centroid_rgb[indices], dtype=pl.Array(pl.Float32, 3)),
+            proportion=pl.Series(self.centroid_proportion[indices]),
+            delta_e=pl.Series(distances[first].astype(np.float32)),
+        )
+
+    def year_proportions(self) -> pl.DataFrame:
+        """
+        year_proportions Average share of each global color on the covers of each year
+
+        Returns:
+            `pl.DataFrame`: year, global color index, its sRGB color and proportion, one row per year and global color
+        """
+        years, cover_years = np.unique(
+            self.covers.get_column("year").to_numpy(), return_inverse=True
+        )
+        totals: np.ndarray = np.zeros((len(years), self.cover_histograms.shape[1]))
+        np.add.at(totals, cover_years, self.cover_histograms)
+        proportions: np.ndarray = totals / np.bincount(cover_years)[:, None]
+        n_colors: int = len(self.global_rgb)
+        return pl.DataFrame(
+            {
+                "year": np.repeat(years, n_colors),
+                "global_color": np.tile(np.arange(n_colors), len(years)),
+                "color": pl.Series(
+                    np.tile(self.global_rgb, (len(years), 1)), dtype=pl.Array(pl.Float32, 3)
+                ),
+                "proportion": proportions.reshape(-1).astype(np.float32),
+            }
+        )
+
+    def palette_similarity(self, filename_a: str, filename_b: str) -> float:
+        """
+        palette_similarity Share of color two covers have in common over the global palette
+
+        Args:
+            `filename_a (str)`: Cover filename
+            `filename_b (str)`: Cover filename
+
+        Returns:
+            `float`: Histogram intersection in [0, 1]. 1 means the same mix of global colors
+        """
+        return float(
+            np.minimum(
+                self.cover_histograms[self._rows[filename_a]],
+                self.cover_histograms[self._rows[filename_b]],
+            ).sum()
+        )
+
+    def similar_covers(self, filename: str, k: int = 10) -> pl.DataFrame:
+        """
+        similar_covers Rank the other covers by `palette_similarity` to a cover
+
+        Args:
+            `filename (str)`: Cover filename
+            `k (int)`: Number of covers
+
+        Returns:
+            `pl.DataFrame`: filename, year, month and similarity, most similar first
+        """
+        row: int = self._rows[filename]
+        similarity: np.ndarray = np.minimum(
+            self.cover_histograms, self.cover_histograms[row]
+        ).sum(axis=1)
+        similarity[row] = -np.inf
+        order: np.ndarray = np.argsort(-similarity, kind="stable")[
+            : min(k, len(similarity) - 1)
+        ]
+        return self.covers[order].select("filename", "year", "month").with_columns(
+            similarity=pl.Series(similarity[order])
+        )
@@ -0,0 +1,72 @@
+from pathlib import Path
+
+import metrics as mt
+import numpy as np
+from PIL import Image
+
+# (left, top, right, bottom) of each square as a fraction of the image size, drawn in order.
+# The first color fills the background and the next three are the inner squares.
+SQUARE_LAYOUT: tuple[tuple[float, float, float, float], ...] = (
+    (0.0, 0.0, 1.0, 1.0),
+    (0.125, 0.125, 0.5, 0.875),
+    (0.5, 0.125, 0.875, 0.5),
+    (0.5, 0.5, 0.875, 0.875),
+)
+
+
+def render_square(
+    colors: np.ndarray,
+    size: int = 200,
+    layout: tuple[tuple[float, float, float, float], ...] = SQUARE_LAYOUT,
+) -> np.ndarray:
+    """
+    render_square Paint the color square layout into a NumPy array
+
+    Args:
+        `colors (np.ndarray)`: `(n, 3)` RGB colors, one per rectangle of the layout
+        `size (int)`: Width and height of the square in pixels
+        `layout (tuple[tuple[float, float, float, float], ...])`: Rectangles as fractions of the size
+
+    Returns:
+        `np.ndarray`: `(size, size, 3)` uint8 RGB array
+    """
+    if len(colors) < len(layout):
+        raise ValueError(f"The layout needs {len(layout)} colors, got {len(colors)}")
+
+    square: np.ndarray = np.empty((size, size, 3), dtype=np.uint8)
+    rgb: np.ndarray = np.clip(np.rint(colors), 0, 255).astype(np.uint8)
+    for (left, top, right, bottom), color in zip(layout, rgb):
+        square[
+            round(top * size) : round(bottom * size),
+            round(left * size) : round(right * size),
+        ] = color
+    return square
+
+
+@mt.timed("render.square")
+def save_square(
+    colors: np.ndarray,
+    output_file: str | Path,
+    size: int = 200,
+    layout: tuple[tuple[float, float, float, float], ...] = SQUARE_LAYOUT,
+) -> Path:
+    """
+    save_square Render the color square layout and write it straight to disk
+
+    Args:
+        `colors (np.ndarray)`: `(n, 3)` RGB colors, one per rectangle of the layout
+        `output_file (str | Path)`: Destination file. The format follows the suffix, e.g. `.webp` or `.png`
+        `size (int)`: Width and height of the square in pixels
+        `layout (tuple[tuple[float, float, float, float], ...])`: Rectangles as fractions of the size
+
+    Returns:
+        `Path`: Path of the written file
+    """
+    output_file = Path(output_file)
+    image: Image.Image = Image.fromarray(render_square(colors, size, layout))
+    if output_file.suffix.lower() == ".webp":
+        # Flat colors compress well losslessly and keep the exact centroid values
+        image.save(output_file, lossless=True, method=0)
+    else:
+        image.save(output_file)
+    return output_file
@@ -0,0 +1,154 @@
+from pathlib import Path
+
+import palette_store as ps
+import polars as pl
+
+OG_IMG_FILEPATH: Path = Path.cwd() / "data" / "raw" / "cooks-illustrated"
+SQUARES_FILEPATH: Path = Path.cwd() / "data" / "processed" / "kmeans-squares"
+MAGAZINE_FILEPATH: Path = Path.cwd() / "data" / "raw" / "magazine_covers.parquet"
+PALETTE_FILEPATH: Path = Path.cwd() / "data" / "processed" / "palettes"
+
+
+def scan_magazines(
+    magazine_filepath: Path = MAGAZINE_FILEPATH, include_blank: bool = False
+) -> pl.LazyFrame:
+    """
+    scan_magazines Lazily scan the magazine metadata written by `run_gather_magazines`
+
+    Args:
+        `magazine_filepath (Path)`: Magazine metadata Parquet file. A CSV from older runs is also accepted
+        `include_blank (bool)`: Keep the issues without a cover image. Otherwise the filter is pushed down into the scan
+
+    Returns:
+        `pl.LazyFrame`: Polars LazyFrame
+    """
+    if magazine_filepath.suffix == ".csv":
+        magazines: pl.LazyFrame = pl.scan_csv(magazine_filepath)
+    else:
+        magazines = pl.scan_parquet(magazine_filepath)
+    if not include_blank:
+        magazines = magazines.filter(pl.col("is_blank_cover") != 1)
+    return magazines
+
+
+def read_magazines(
+    magazine_filepath: Path = MAGAZINE_FILEPATH, include_blank: bool = False
+) -> pl.DataFrame:
+    """
+    read_magazines Read the magazine metadata in chronological order
+
+    Args:
+        `magazine_filepath (Path)`: Magazine metadata Parquet file
+        `include_blank (bool)`: Keep the issues without a cover image
+
+    Returns:
+        `pl.DataFrame`: Polars DataFrame sorted by year and start month
+    """
+    return (
+        scan_magazines(magazine_filepath, include_blank)
+        .sort("year", "start_month_num")
+        .collect()
+    )
+
+
+def _list_files(folder: Path, pattern: str, suffix: str, column: str) -> pl.DataFrame:
+    paths: list[Path] = sorted(folder.glob(pattern)) if folder.is_dir() else []
+    return pl.DataFrame(
+        {
+            "filename": [path.name.removesuffix(suffix) for path in paths],
+            column: [str(path) for path in paths],
+        },
+        schema={"filename": pl.String, column: pl.String},
+    )
+
+
+def build_cover_index(
+    magazine_filepath: Path = MAGAZINE_FILEPATH,
+    og_img_filepath: Path = OG_IMG_FILEPATH,
+    squares_filepath: Path = SQUARES_FILEPATH,
+    palette_filepath: Path | None = PALETTE_FILEPATH,
+    include_blank: bool = False,
+) -> pl.DataFrame:
+    """
+    build_cover_index Join the magazine metadata with the raw cover, KMeans square and palette of every issue
+
+    Each folder is listed once and joined on the `filename` key, so pairing covers with squares never
+    depends on glob order and no stage searches through a Python list.
+
+    Args:
+        `magazine_filepath (Path)`: Magazine metadata Parquet file
+        `og_img_filepath (Path)`: Folder of raw covers
+        `squares_filepath (Path)`: Folder of KMeans squares
+        `palette_filepath (Path | None)`: Folder of the palette table. `None` skips the palette columns
+        `include_blank (bool)`: Keep the issues without a cover image
+
+    Returns:
+        `pl.DataFrame`: One row per issue in chronological order, with `cover_path` and `square_path` (null when missing) and the palette columns when available
+    """
+    cover_index: pl.DataFrame = (
+        read_magazines(magazine_filepath, include_blank)
+        .with_columns(pl.col("filename").cast(pl.String))
+        .join(
+            _list_files(og_img_filepath, "*.jpg", ".jpg", "cover_path"),
+            on="filename",
+            how="left",
+        )
+        .join(
+            _list_files(squares_filepath, "*-square.webp", "-square.webp", "square_path"),
+            on="filename",
+            how="left",
+        )
+    )
+    if palette_filepath is not None and any(palette_filepath.glob("part-*.parquet")):
+        palettes: pl.DataFrame = (
+            ps.scan_palettes(palette_filepath)
+            .select("filename", "centroids", "proportions", "kmeans_params")
+            .unique(subset="filename", keep="last", maintain_order=True)
+            .collect()
+        )
+        cover_index = cover_index.join(palettes, on="filename", how="left")
+    return cover_index
+
+
+def cover_lookup(cover_index: pl.DataFrame) -> dict[str, dict]:
+    """
+    cover_lookup Return a dictionary of {filename: row} for O(1) lookups
+
+    Args:
+        `cover_index (pl.DataFrame)`: Output of `build_cover_index`
+
+    Returns:
+        `dict[str, dict]`: Each row of the index keyed by its filename
+    """
+    return {row["filename"]: row for row in cover_index.iter_rows(named=True)}
+
+
+def cover_paths(cover_index: pl.DataFrame) -> list[str]:
+    """
+    cover_paths Return the raw cover of every issue that has been downloaded, in chronological order
+
+    Args:
+        `cover_index (pl.DataFrame)`: Output of `build_cover_index`
+
+    Returns:
+        `list[str]`: Cover filepaths
+    """
+    return cover_index.drop_nulls("cover_path").get_column("cover_path").to_list()
+
+
+def frame_paths(cover_index: pl.DataFrame) -> list[tuple[Path, Path]]:
+    """
+    frame_paths Return the (cover, square) pairs of every issue that has both, in chronological order
+
+    Args:
+        `cover_index (pl.DataFrame)`: Output of `build_cover_index`
+
+    Returns:
+        `list[tuple[Path, Path]]`: (cover, square) paths
+    """
+    return [
+        (Path(cover), Path(square))
+        for cover, square in cover_index.drop_nulls(["cover_path", "square_path"])
+        .select("cover_path", "square_path")
+        .iter_rows()
+    ]
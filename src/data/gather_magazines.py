@@ -1,8 +1,17 @@
-from dataclasses import dataclass, field, fields
+import asyncio
+import hashlib
+import inspect
+import json
+import os
+import random
+import time
+from dataclasses import asdict, dataclass, field, fields
 from pathlib import Path
-from typing import Any, Generator
+from typing import Any, Awaitable, Callable, Generator
+from urllib.parse import urlsplit
 
 import httpx
+import metrics as mt
 import polars as pl
 from selectolax.parser import HTMLParser
 
@@ -63,30 +72,43 @@ def gather_dtype(dataclass_obj: Magazine) -> dict[str, str]:
     return dtype_dict
 
 
+@dataclass
+class CleanMagazine:
+    name: str = field(metadata={"dtype": pl.String})
+    year: int = field(metadata={"dtype": pl.Int16})
+    start_month_num: int = field(metadata={"dtype": pl.Int8})
+    end_month_num: int = field(metadata={"dtype": pl.Int8})
+    start_month_str: str = field(metadata={"dtype": pl.Categorical})
+    end_month_str: str = field(metadata={"dtype": pl.Categorical})
+    cleaned_link: str = field(metadata={"dtype": pl.String})
+    is_blank_cover: int = field(metadata={"dtype": pl.Int8})
+    filename: str = field(metadata={"dtype": pl.String})
+
+
 # References for date source code
 # https://stackoverflow.com/a/77836528/8646265
 # https://stackoverflow.com/a/75601785/8646265
-def clean_df_name(df: pl.DataFrame) -> pl.DataFrame:
+def clean_df_name(df: pl.DataFrame | pl.LazyFrame) -> pl.DataFrame | pl.LazyFrame:
     """
     clean_df_name Return a polars dataframe with some transformations applied
 
+    The transformations run as a lazy query and the result is cast to the `CleanMagazine` schema.
+
     Args:
-        `df (pl.DataFrame)`: Polars DataFrame
+        `df (pl.DataFrame | pl.LazyFrame)`: Polars DataFrame or LazyFrame
 
     Returns:
-        `pl.DataFrame`: Polars DataFrame
+        `pl.DataFrame | pl.LazyFrame`: Polars DataFrame, or LazyFrame when given one
     """
-    return (
-        df.with_columns(
-            year=("1 " + pl.col("name").str.replace("/.* ", ""))
-            .str.to_datetime("%d %B %Y")
-            .dt.year(),
-            start_month_num=("1 " + pl.col("name").str.replace("/.* ", ""))
-            .str.to_datetime("%d %B %Y")
-            .dt.month(),
+    cleaned: pl.LazyFrame = (
+        df.lazy()
+        .with_columns(
+            start_date=("1 " + pl.col("name").str.replace("/.* ", "")).str.to_date(
+                "%d %B %Y"
+            ),
             end_month_num=pl.col("name")
             .str.replace(".*/", "1 ")
-            .str.to_datetime("%d %B %Y")
+            .str.to_date("%d %B %Y")
             .dt.month(),
             start_month_str=pl.col("name").str.extract(r"(\w+)\/"),
             end_month_str=pl.col("name").str.extract(r"\/(\w+)"),
@@ -95,16 +117,27 @@ def clean_df_name(df: pl.DataFrame) -> pl.DataFrame:
             ),
         )
         .with_columns(
+            year=pl.col("start_date").dt.year(),
+            start_month_num=pl.col("start_date").dt.month(),
             is_blank_cover=pl.when(
                 pl.col("cleaned_link").str.contains(
                     r"https://res.cloudinary.com/hksqkdlah/image/upload/Recipe_Default_zbu7tq"
                 )
             )
             .then(pl.lit(1, dtype=pl.Int8))
-            .otherwise(pl.lit(0, dtype=pl.Int8))
+            .otherwise(pl.lit(0, dtype=pl.Int8)),
         )
         .select(
-            pl.col("*").exclude("image_link"),
+            pl.col(
+                "name",
+                "year",
+                "start_month_num",
+                "end_month_num",
+                "start_month_str",
+                "end_month_str",
+                "cleaned_link",
+                "is_blank_cover",
+            ),
             filename=pl.concat_str(
                 [
                     pl.col("year"),
@@ -114,6 +147,33 @@ def clean_df_name(df: pl.DataFrame) -> pl.DataFrame:
                 separator="_",
             ),
         )
+        .cast(gather_dtype(CleanMagazine))
+    )
+    return cleaned.collect() if isinstance(df, pl.DataFrame) else cleaned
+
+
+def merge_magazines(
+    new_covers: pl.DataFrame, magazine_covers: pl.DataFrame
+) -> pl.DataFrame:
+    """
+    merge_magazines Add newly scraped issues to the stored magazine metadata
+
+    Args:
+        `new_covers (pl.DataFrame)`: Output of `clean_df_name` for the new issues
+        `magazine_covers (pl.DataFrame)`: Stored magazine metadata
+
+    Returns:
+        `pl.DataFrame`: Polars DataFrame with one row per issue name, new issues first
+    """
+    schema: dict[str, pl.DataType] = gather_dtype(CleanMagazine)
+    # Categoricals from different frames are unified through String so this works on every Polars version
+    as_string: dict[str, pl.DataType] = {
+        name: pl.String for name, dtype in schema.items() if dtype == pl.Categorical
+    }
+    return (
+        pl.concat([new_covers.cast(as_string), magazine_covers.cast(as_string)])
+        .unique(subset="name", keep="first", maintain_order=True)
+        .cast(schema)
     )
 
 
@@ -131,24 +191,326 @@ def create_img_folder() -> Path:
     return filepath
 
 
-async def download_images(df: pl.DataFrame, client: httpx.AsyncClient) -> None:
+@dataclass
+class DownloadSummary:
+    files: int = 0
+    skipped: int = 0
+    failed: int = 0
+    bytes: int = 0
+    elapsed: float = 0.0
+
+    @property
+    def files_per_second(self) -> float:
+        return self.files / self.elapsed if self.elapsed else 0.0
+
+    @property
+    def bytes_per_second(self) -> float:
+        return self.bytes / self.elapsed if self.elapsed else 0.0
+
+    def __str__(self) -> str:
+        return (
+            f"{self.files} files ({self.skipped} unchanged, {self.failed} failed), "
+            f"{self.bytes / 1e6:.2f} MB "
+            f"in {self.elapsed:.2f} seconds "
+            f"({self.files_per_second:.1f} files/s, {self.bytes_per_second / 1e6:.2f} MB/s)"
+        )
+
+
+class HostRateLimiter:
+    """
+    HostRateLimiter Space out requests to the same host
+
+    Args:
+        `requests_per_second (float | None)`: Maximum request rate per host. `None` disables the limit
+    """
+
+    def __init__(self, requests_per_second: float | None = None) -> None:
+        self.interval: float = 1 / requests_per_second if requests_per_second else 0.0
+        self._next_slot: dict[str, float] = {}
+        self._lock: asyncio.Lock = asyncio.Lock()
+
+    async def wait(self, url: str) -> None:
+        if not self.interval:
+            return
+        host: str = urlsplit(url).netloc
+        async with self._lock:
+            now: float = time.monotonic()
+            slot: float = max(now, self._next_slot.get(host, now))
+            self._next_slot[host] = slot + self.interval
+        await asyncio.sleep(slot - now)
+
+
+@dataclass
+class ManifestEntry:
+    filename: str
+    size: int = 0
+    sha256: str | None = None
+    etag: str | None = None
+    last_modified: str | None = None
+    complete: bool = False
+
+
+class DownloadManifest:
     """
-    download_images Return a list of images to the specified folder in `create_img_folder`
+    DownloadManifest Persistent record of downloaded files keyed by `cleaned_link`
+
+    Updates are written out every `save_every` changes rather than one by one, so call `flush`
+    once the downloads are done. A crash loses at most the unsaved entries, and those files are
+    only downloaded again.
+
+    Args:
+        `path (Path)`: JSON file holding the manifest. Created on the first save
+        `save_every (int)`: Number of updates between saves
+    """
+
+    def __init__(self, path: Path, save_every: int = 50) -> None:
+        self.path: Path = path
+        self.save_every: int = save_every
+        self.entries: dict[str, ManifestEntry] = {}
+        self._unsaved: int = 0
+        if path.exists():
+            with open(path) as f:
+                self.entries = {
+                    link: ManifestEntry(**entry) for link, entry in json.load(f).items()
+                }
+
+    def get(self, link: str) -> ManifestEntry | None:
+        return self.entries.get(link)
+
+    def update(self, link: str, entry: ManifestEntry) -> None:
+        self.entries[link] = entry
+        self._unsaved += 1
+        if self._unsaved >= self.save_every:
+            self.save()
+
+    def flush(self) -> None:
+        if self._unsaved:
+            self.save()
+
+    def save(self) -> None:
+        # Write to a temporary file first so a crash never leaves a truncated manifest
+        tmp_path: Path = self.path.with_name(self.path.name + ".tmp")
+        with open(tmp_path, "w") as f:
+            json.dump({link: asdict(e) for link, e in self.entries.items()}, f, indent=2)
+        os.replace(tmp_path, self.path)
+        self._unsaved = 0
+
+    def is_current(self, link: str, filename: Path) -> bool:
+        """
+        is_current Check whether a completed download for the link is still on disk
+
+        Args:
+            `link (str)`: Image url
+            `filename (Path)`: Expected location of the image
+
+        Returns:
+            `bool`: True if the manifest has a completed entry whose size matches the file on disk
+        """
+        entry: ManifestEntry | None = self.get(link)
+        return (
+            entry is not None
+            and entry.complete
+            and filename.exists()
+            and filename.stat().st_size == entry.size
+        )
+
+
+MANIFEST_FILENAME: str = "download-manifest.json"
+RETRY_STATUS_CODES: frozenset[int] = frozenset({429, 500, 502, 503, 504})
+
+
+@mt.timed("download.file")
+async def download_file(
+    client: httpx.AsyncClient,
+    url: str,
+    filename: Path,
+    rate_limiter: HostRateLimiter,
+    retries: int = 3,
+    backoff: float = 0.5,
+    manifest: DownloadManifest | None = None,
+    buffer: bytearray | None = None,
+) -> int | None:
+    """
+    download_file Stream a single url to disk, retrying transient failures with exponential backoff
+
+    Data is streamed into `<filename>.part` and renamed once complete. With a manifest, an
+    existing file is revalidated with a conditional request and an interrupted `.part` file is
+    resumed with a Range request. With a buffer, the complete file is also kept in memory so it
+    can be decoded without reading it back from disk.
+
+    Args:
+        `client (httpx.AsyncClient)`: httpx AsyncClient
+        `url (str)`: Url to download
+        `filename (Path)`: Destination file
+        `rate_limiter (HostRateLimiter)`: Shared per-host rate limiter
+        `retries (int)`: Number of retries after the first attempt
+        `backoff (float)`: Base delay in seconds, doubled after every failed attempt
+        `manifest (DownloadManifest | None)`: Manifest used for conditional and resumed requests
+        `buffer (bytearray | None)`: Filled with the full contents of the file when it is downloaded
+
+    Returns:
+        `int | None`: Number of bytes transferred, or `None` if the server reported the file unchanged
+    """
+    part_filename: Path = filename.with_name(filename.name + ".part")
+
+    for attempt in range(retries + 1):
+        entry: ManifestEntry | None = manifest.get(url) if manifest else None
+        headers: dict[str, str] = {}
+        offset: int = 0
+
+        if manifest and manifest.is_current(url, filename):
+            if entry.etag:
+                headers["If-None-Match"] = entry.etag
+            if entry.last_modified:
+                headers["If-Modified-Since"] = entry.last_modified
+        elif entry and not entry.complete and part_filename.exists():
+            # Only resume when the server can confirm the partial file is the same version
+            validator: str | None = entry.etag or entry.last_modified
+            if validator:
+                offset = part_filename.stat().st_size
+                headers["Range"] = f"bytes={offset}-"
+                headers["If-Range"] = validator
+
+        await rate_limiter.wait(url)
+        try:
+            async with client.stream("GET", url, headers=headers) as response:
+                if response.status_code == 304:
+                    return None
+                if response.status_code == 416:
+                    part_filename.unlink(missing_ok=True)
+                    continue
+                response.raise_for_status()
+
+                sha256 = hashlib.sha256()
+                if buffer is not None:
+                    buffer.clear()
+                if response.status_code == 206:
+                    mode: str = "ab"
+                    with open(part_filename, "rb") as f:
+                        for block in iter(lambda: f.read(1 << 20), b""):
+                            sha256.update(block)
+                            if buffer is not None:
+                                buffer.extend(block)
+                else:
+                    mode = "wb"
+                    offset = 0
+
+                if manifest:
+                    manifest.update(
+                        url,
+                        ManifestEntry(
+                            filename=filename.name,
+                            etag=response.headers.get("ETag"),
+                            last_modified=response.headers.get("Last-Modified"),
+                        ),
+                    )
+
+                n_bytes: int = 0
+                with open(part_filename, mode) as f:
+                    async for chunk in response.aiter_bytes(chunk_size=65536):
+                        f.write(chunk)
+                        sha256.update(chunk)
+                        if buffer is not None:
+                            buffer.extend(chunk)
+                        n_bytes += len(chunk)
+
+            os.replace(part_filename, filename)
+            if manifest:
+                entry = manifest.get(url)
+                entry.size = offset + n_bytes
+                entry.sha256 = sha256.hexdigest()
+                entry.complete = True
+                manifest.update(url, entry)
+            return n_bytes
+        except (httpx.TransportError, httpx.HTTPStatusError) as exc:
+            if attempt == retries or (
+                isinstance(exc, httpx.HTTPStatusError)
+                and exc.response.status_code not in RETRY_STATUS_CODES
+            ):
+                raise
+            delay: float = backoff * 2**attempt
+            await asyncio.sleep(delay + random.uniform(0, delay / 2))
+    raise httpx.HTTPError(f"Could not download {url} after {retries + 1} attempts")
+
+
+async def download_images(
+    df: pl.DataFrame,
+    client: httpx.AsyncClient,
+    filepath: Path | None = None,
+    max_concurrency: int = 8,
+    requests_per_second: float | None = None,
+    retries: int = 3,
+    backoff: float = 0.5,
+    revalidate: bool = True,
+    on_download: Callable[[Path, bytes], Awaitable[None] | None] | None = None,
+) -> DownloadSummary:
+    """
+    download_images Download every `cleaned_link` in the dataframe concurrently to the specified folder in `create_img_folder`
 
     Args:
         `df (pl.DataFrame)`: Polars DataFrame
         `client (httpx.AsyncClient)`: httpx AsyncClient
+        `filepath (Path | None)`: Destination folder. Prompts with `create_img_folder` when `None`
+        `max_concurrency (int)`: Maximum number of simultaneous streams
+        `requests_per_second (float | None)`: Maximum request rate per host. `None` disables the limit
+        `retries (int)`: Number of retries per file after the first attempt
+        `backoff (float)`: Base delay in seconds between retries
+        `revalidate (bool)`: Send a conditional request for files already in the manifest. When False, they are skipped without a request
+        `on_download (Callable[[Path, bytes], Awaitable[None] | None] | None)`: Called with the path and contents of every file as soon as it has been downloaded, so later stages can start on it without reading it back. Coroutines are awaited, so a callback that waits on a bounded queue holds back further downloads
+
+    Returns:
+        `DownloadSummary`: Number of files and bytes downloaded and the throughput
     """
-    filepath: Path = create_img_folder()
+    if filepath is None:
+        filepath = create_img_folder()
+
+    manifest: DownloadManifest = DownloadManifest(filepath / MANIFEST_FILENAME)
 
-    for row in df.iter_rows(named=True):
-        filename = (filepath / row["filename"]).with_suffix(".jpg")
-        async with client.stream("GET", row["cleaned_link"]) as response:
-            print("Downloading the images...")
-            with open(filename, "wb") as f:
-                print("Writing data to file")
-                async for chunk in response.aiter_bytes(chunk_size=4096):
-                    f.write(chunk)
+    semaphore: asyncio.Semaphore = asyncio.Semaphore(max_concurrency)
+    rate_limiter: HostRateLimiter = HostRateLimiter(requests_per_second)
+    summary: DownloadSummary = DownloadSummary()
+
+    async def worker(url: str, filename: Path) -> None:
+        if not revalidate and manifest.is_current(url, filename):
+            summary.skipped += 1
+            return
+        buffer: bytearray | None = bytearray() if on_download is not None else None
+        async with semaphore:
+            try:
+                n_bytes: int | None = await download_file(
+                    client, url, filename, rate_limiter, retries, backoff, manifest, buffer
+                )
+            except httpx.HTTPError as exc:
+                summary.failed += 1
+                print(f"Failed to download {url}: {exc!r}")
+                return
+        if n_bytes is None:
+            summary.skipped += 1
+            return
+        summary.files += 1
+        summary.bytes += n_bytes
         print(f"File saved as {filename}")
+        if on_download is not None:
+            result: Awaitable[None] | None = on_download(filename, bytes(buffer))
+            if inspect.isawaitable(result):
+                await result
+
+    print("Downloading the images...")
+    start_time: float = time.perf_counter()
+    try:
+        await asyncio.gather(
+            *(
+                worker(row["cleaned_link"], (filepath / row["filename"]).with_suffix(".jpg"))
+                for row in df.iter_rows(named=True)
+            )
+        )
+    finally:
+        manifest.flush()
+    summary.elapsed = time.perf_counter() - start_time
+    mt.count("download.files", summary.files)
+    mt.count("download.bytes", summary.bytes)
+    mt.count("download.skipped", summary.skipped)
+    mt.count("download.failed", summary.failed)
 
-    print("Download complete")
+    print(f"Download complete: {summary}")
+    return summary
@@ -0,0 +1,110 @@
+import io
+from pathlib import Path
+
+import numpy as np
+from PIL import Image
+
+
+def decoded_array(source) -> np.ndarray | None:
+    """
+    decoded_array Return the pixels of a source that is already decoded, without copying
+
+    Args:
+        `source`: A `(height, width, 3)` uint8 array, or an object with an `image_array()` method such as a `pixel_archive.ArchiveEntry`
+
+    Returns:
+        `np.ndarray | None`: `(height, width, 3)` uint8 array, or `None` for files and encoded bytes
+    """
+    if hasattr(source, "image_array"):
+        return source.image_array()
+    if isinstance(source, np.ndarray):
+        return source
+    return None
+
+
+def open_image(source: str | Path | bytes) -> Image.Image:
+    """
+    open_image Open an image from a filepath, the encoded bytes of a file already in memory or decoded pixels
+
+    Args:
+        `source (str | Path | bytes)`: Image filepath, encoded image bytes, or any source accepted by `decoded_array`
+
+    Returns:
+        `Image.Image`: Lazily decoded image
+    """
+    image_array: np.ndarray | None = decoded_array(source)
+    if image_array is not None:
+        return Image.fromarray(image_array)
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        return Image.open(io.BytesIO(source))
+    return Image.open(source)
+
+
+def load_image(
+    source: str | Path | bytes,
+    size: tuple[int, int] | None = None,
+    mode: str = "RGB",
+) -> Image.Image:
+    """
+    load_image Decode an image once, in the mode and at the size the consumer needs
+
+    JPEGs are decoded with `Image.draft`, which lets the decoder downscale by 1/2, 1/4 or 1/8 in
+    the DCT domain while staying at least as large as `size`, so pixels that the resize would
+    throw away are never decoded. The mode is checked on the header instead of on decoded pixels
+    and converted only when it differs.
+
+    Args:
+        `source (str | Path | bytes)`: Image filepath, encoded image bytes or decoded pixels
+        `size (tuple[int, int] | None)`: Width and height of the result. `None` keeps the full size
+        `mode (str)`: Pillow mode of the result
+
+    Returns:
+        `Image.Image`: Fully loaded image. The file is closed
+    """
+    # Leaving the block closes the file but keeps the loaded pixels
+    with open_image(source) as img:
+        if size is not None and img.format == "JPEG":
+            img.draft(mode, size)
+        img.load()
+
+    if img.mode != mode:
+        img = img.convert(mode)
+    if size is not None and img.size != size:
+        img = img.resize(size, Image.LANCZOS)
+    return img
+
+
+def pixel_array(img: Image.Image) -> np.ndarray:
+    """
+    pixel_array View a loaded image as a C-contiguous `(n, channels)` uint8 array, one row per pixel
+
+    Args:
+        `img (Image.Image)`: Loaded image with 8 bits per channel
+
+    Returns:
+        `np.ndarray`: `(width * height, channels)` uint8 array
+    """
+    return np.asarray(img, dtype=np.uint8).reshape(-1, len(img.getbands()))
+
+
+def load_pixels(
+    source: str | Path | bytes, size: tuple[int, int] | None = None
+) -> np.ndarray:
+    """
+    load_pixels Decode an image into the `(n, 3)` RGB pixel array used for clustering
+
+    Pixels that are already decoded at the right size are returned as a view, without a copy.
+
+    Args:
+        `source (str | Path | bytes)`: Image filepath, encoded image bytes or decoded pixels
+        `size (tuple[int, int] | None)`: Width and height to decode at. `None` keeps the full size
+
+    Returns:
+        `np.ndarray`: `(width * height, 3)` uint8 array
+    """
+    image_array: np.ndarray | None = decoded_array(source)
+    if image_array is not None and (
+        size is None or image_array.shape[1::-1] == tuple(size)
+    ):
+        return image_array.reshape(-1, 3)
+    return pixel_array(load_image(source, size))
@@ -1,55 +1,464 @@
-from collections import Counter
+import os
+from collections.abc import Iterable, Iterator, Sequence
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
 
+import color_conversion as cc
+import image_io as imio
 import numpy as np
 from PIL import Image
-from sklearnex import patch_sklearn
+from threadpoolctl import threadpool_limits
 
-patch_sklearn()  # Comment out if you don't want to use this
+# Set to False, or set the USE_SKLEARNEX=0 environment variable, if you don't want to use this
+USE_SKLEARNEX: bool = os.environ.get("USE_SKLEARNEX", "1") != "0"
+_sklearnex_patched: bool = False
 
-from sklearn.cluster import KMeans  # noqa: E402
+
+def patch_sklearnex() -> None:
+    """
+    patch_sklearnex Patch scikit-learn with the Intel® Extension for Scikit-learn once per process
+    """
+    global _sklearnex_patched
+    if USE_SKLEARNEX and not _sklearnex_patched:
+        from sklearnex import patch_sklearn
+
+        patch_sklearn()
+        _sklearnex_patched = True
+
+
+patch_sklearnex()
+
+from sklearn.cluster import KMeans, MiniBatchKMeans  # noqa: E402
+
+
+ENGINES: tuple[str, ...] = ("pixels", "unique", "histogram", "minibatch")
+COLOR_SPACES: tuple[str, ...] = tuple(cc.COLOR_SPACES)
+# Longest run of covers warm-started one after another in a single worker
+WARM_START_CHUNK: int = 8
+
+
+def collapse_colors(
+    X: np.ndarray, quantize_bits: int | None = None
+) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    collapse_colors Collapse an array of pixels into its distinct colors and their counts
+
+    Args:
+        `X (np.ndarray)`: `(n, 3)` uint8 array of RGB pixels
+        `quantize_bits (int | None)`: Bits per channel of the color histogram. `None` keeps every unique color. Histogram bins are represented by the mean color of their pixels
+
+    Returns:
+        `tuple[np.ndarray, np.ndarray, np.ndarray]`: `(m, 3)` colors, `(m,)` pixel counts and the `(n,)` index of each pixel's color
+    """
+    X = np.asarray(X, dtype=np.uint8)
+    if quantize_bits:
+        q: np.ndarray = (X >> (8 - quantize_bits)).astype(np.int64)
+        keys: np.ndarray = (
+            (q[:, 0] << (2 * quantize_bits)) | (q[:, 1] << quantize_bits) | q[:, 2]
+        )
+        n_bins: int = 1 << (3 * quantize_bits)
+        bin_counts: np.ndarray = np.bincount(keys, minlength=n_bins)
+        occupied: np.ndarray = np.flatnonzero(bin_counts)
+        counts: np.ndarray = bin_counts[occupied]
+        colors: np.ndarray = np.stack(
+            [
+                np.bincount(keys, weights=X[:, c], minlength=n_bins)[occupied]
+                for c in range(3)
+            ],
+            axis=1,
+        ) / counts[:, None]
+        lookup: np.ndarray = np.zeros(n_bins, dtype=np.intp)
+        lookup[occupied] = np.arange(len(occupied))
+        inverse: np.ndarray = lookup[keys]
+    else:
+        packed: np.ndarray = (
+            (X[:, 0].astype(np.uint32) << 16) | (X[:, 1].astype(np.uint32) << 8) | X[:, 2]
+        )
+        unique, inverse, counts = np.unique(
+            packed, return_inverse=True, return_counts=True
+        )
+        colors = np.stack([unique >> 16, (unique >> 8) & 255, unique & 255], axis=1)
+    return colors.astype(np.float32), counts, inverse.reshape(-1)
+
+
+def kmeans_colors(
+    filepath: str | Path | bytes,
+    n_clusters: int,
+    quantize_bits: int | None = None,
+    n_init: int | str = "auto",
+    random_state: int | None = None,
+) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    kmeans_colors Weighted kmeans over the distinct colors of an image instead of every pixel
+
+    Args:
+        `filepath` (str | Path | bytes): Image filepath or encoded image bytes
+        `n_clusters` (int): Number of centroids
+        `quantize_bits` (int | None): Bits per channel of the color histogram. `None` keeps every unique color
+        `n_init` (int | str): Number of k-means++ initializations
+        `random_state` (int | None): Seed for the centroid initialization
+
+    Returns:
+        tuple[np.ndarray, np.ndarray, np.ndarray]: centroids, a label per distinct color and the pixel count of each distinct color. Pass the counts to `get_color_labels` as `sample_weight`
+    """
+    X: np.ndarray = imio.load_pixels(filepath)
+    colors, counts, _ = collapse_colors(X, quantize_bits)
+    kmeans: KMeans = KMeans(
+        n_clusters=min(n_clusters, len(colors)), n_init=n_init, random_state=random_state
+    )
+    kmeans.fit(colors, sample_weight=counts)
+    # With fewer distinct colors than clusters, repeat the last centroid. No color is labeled with the copies
+    centroids: np.ndarray = np.concatenate(
+        [
+            kmeans.cluster_centers_,
+            np.repeat(kmeans.cluster_centers_[-1:], n_clusters - kmeans.n_clusters, axis=0),
+        ]
+    )
+    return centroids, kmeans.labels_, counts
 
 
-def kmeans_img(filepath: str | Path, n_clusters: int) -> tuple[np.ndarray, np.ndarray]:
+def kmeans_img(
+    filepath: str | Path | bytes,
+    n_clusters: int,
+    n_init: int | str = "auto",
+    random_state: int | None = None,
+    sample_size: int | None = None,
+    reduce_factor: int | None = None,
+    engine: str = "pixels",
+    color_space: str = "rgb",
+    init_centroids: np.ndarray | None = None,
+    return_n_iter: bool = False,
+) -> tuple[np.ndarray, np.ndarray] | tuple[np.ndarray, np.ndarray, int]:
     """
     kmeans_img Generate kmeans image classifier
 
+    By default every pixel is clustered. For a faster fit, pass `sample_size` to fit on a
+    deterministic random sample of pixels, or `reduce_factor` to fit on a thumbnail made with
+    `Image.reduce`. Labels are then assigned to every pixel of the full image in one pass.
+
+    The `unique` and `histogram` engines collapse the fitted pixels into their unique colors or
+    a 5-bit-per-channel histogram and run a weighted kmeans on those few thousand points, or
+    fit every pixel when there are fewer of them than `n_clusters`. The
+    `minibatch` engine fits the pixels with `MiniBatchKMeans`, updating the centroids from small
+    random batches.
+
+    Passing the centroids of a similar image, e.g. the previous cover, as `init_centroids` starts
+    a single fit from them instead of several k-means++ initializations.
+
+    With `color_space="lab"` or `"oklab"` the colors are clustered in a perceptual color space,
+    where distances follow how different colors look, and the centroids are converted back to
+    sRGB.
 
     Args:
-        `filepath` (str): Image filepath
+        `filepath` (str | Path | bytes): Image filepath, the encoded bytes of an image already in memory, or decoded pixels such as a `pixel_archive.ArchiveEntry`
         `n_clusters` (int): Number of centroids
+        `n_init` (int | str): Number of k-means++ initializations
+        `random_state` (int | None): Seed for the centroid initialization and the pixel sample
+        `sample_size` (int | None): Number of pixels to fit on
+        `reduce_factor` (int | None): Integer downscaling factor of the image to fit on
+        `engine` (str): One of `pixels`, `unique`, `histogram` or `minibatch`
+        `color_space` (str): One of `rgb`, `lab` or `oklab`
+        `init_centroids` (np.ndarray | None): `(n_clusters, 3)` sRGB centroids to start from
+        `return_n_iter` (bool): Also return the number of iterations the fit took, counted in mini-batch steps for `minibatch`
 
     Returns:
-        tuple[np.ndarray, np.ndarray]: centroids and image labels
+        tuple[np.ndarray, np.ndarray] | tuple[np.ndarray, np.ndarray, int]: sRGB centroids, image labels and, with `return_n_iter`, the number of iterations
     """
+    if engine not in ENGINES:
+        raise ValueError(f"engine must be one of {ENGINES}, got {engine!r}")
+    if color_space not in COLOR_SPACES:
+        raise ValueError(
+            f"color_space must be one of {COLOR_SPACES}, got {color_space!r}"
+        )
 
-    with Image.open(filepath) as img:
-        # Convert any RGBA -> RGB
-        if np.asarray(img).shape[2] == 4:
-            X: np.ndarray = np.asarray(img.convert(mode="RGB")).reshape(-1, 3)
-        else:
-            X = np.asarray(img).reshape(-1, 3)
-        kmeans: KMeans = KMeans(n_clusters=n_clusters)
-        kmeans.fit(X)
-        color_palette = kmeans.cluster_centers_
-        color_labels = kmeans.labels_
+    def to_features(colors: np.ndarray) -> np.ndarray:
+        if color_space == "rgb":
+            return colors
+        return cc.to_color_space(colors, color_space)
+
+    # Pixels from the archive are used in place. Files are decoded once, straight into RGB
+    image_array: np.ndarray | None = imio.decoded_array(filepath)
+    if image_array is not None:
+        img: Image.Image | None = None
+        X: np.ndarray = image_array.reshape(-1, 3)
+    else:
+        img = imio.load_image(filepath)
+        X = imio.pixel_array(img)
+
+    if reduce_factor and reduce_factor > 1:
+        if img is None:
+            img = Image.fromarray(image_array)
+        X_fit: np.ndarray = imio.pixel_array(img.reduce(reduce_factor))
+    else:
+        X_fit = X
+    if sample_size and sample_size < len(X_fit):
+        rng: np.random.Generator = np.random.default_rng(
+            0 if random_state is None else random_state
+        )
+        X_fit = X_fit[rng.choice(len(X_fit), size=sample_size, replace=False)]
 
+    init: str | np.ndarray = "k-means++"
+    if init_centroids is not None:
+        init = to_features(np.asarray(init_centroids, dtype=np.float32))
+        n_init = 1
+    estimator: type[KMeans] | type[MiniBatchKMeans] = (
+        MiniBatchKMeans if engine == "minibatch" else KMeans
+    )
+    kmeans: KMeans | MiniBatchKMeans = estimator(
+        n_clusters=n_clusters, init=init, n_init=n_init, random_state=random_state
+    )
+    colors: np.ndarray | None = None
+    if engine in ("unique", "histogram"):
+        colors, counts, inverse = collapse_colors(
+            X_fit, quantize_bits=5 if engine == "histogram" else None
+        )
+    if colors is not None and len(colors) >= n_clusters:
+        kmeans.fit(to_features(colors), sample_weight=counts)
+        fit_labels: np.ndarray = kmeans.labels_[inverse]
+    else:
+        # A weighted fit needs at least n_clusters points, so images with fewer distinct
+        # colors are fitted pixel by pixel like the pixels engine
+        kmeans.fit(to_features(X_fit))
+        fit_labels = kmeans.labels_
+    color_palette = kmeans.cluster_centers_
+    if color_space != "rgb":
+        color_palette = cc.from_color_space(color_palette, color_space)
+    color_labels = fit_labels if X_fit is X else kmeans.predict(to_features(X))
+
+    if return_n_iter:
+        # MiniBatchKMeans counts full passes in n_iter_ and mini-batch updates in n_steps_
+        n_iter: int = kmeans.n_steps_ if engine == "minibatch" else kmeans.n_iter_
+        return color_palette, color_labels, n_iter
     return color_palette, color_labels
 
 
-def get_color_labels(color_labels: np.ndarray) -> list[tuple]:
+def kmeans_rank(filepath: str | Path | bytes, **kwargs) -> np.ndarray:
     """
-    get_color_labels Extract 4 colors from KMeans labels
+    kmeans_rank Fit `kmeans_img` and return only the ranked palette, which is much smaller to send between processes than the labels
+
+    Args:
+        `filepath` (str | Path | bytes): Image filepath or encoded image bytes
+        `**kwargs`: Keyword arguments for `kmeans_img`
+
+    Returns:
+        np.ndarray: output of rank_palette
+    """
+    return rank_palette(*kmeans_img(filepath, **kwargs))
+
+
+def init_worker() -> None:
+    # One BLAS/OpenMP thread per process so the pool doesn't oversubscribe the cores
+    global _thread_limits
+    _thread_limits = threadpool_limits(limits=1)
+    patch_sklearnex()
+
+
+def _kmeans_task(args: tuple[str | Path, dict]) -> np.ndarray:
+    filepath, kwargs = args
+    return kmeans_rank(filepath, **kwargs)
+
+
+def _warm_start_centroids(ranked_palette: np.ndarray, n_clusters: int) -> np.ndarray | None:
+    # Empty clusters are left out of a ranked palette, and a fit needs a centroid per cluster
+    return ranked_palette["color"] if len(ranked_palette) == n_clusters else None
+
+
+def _kmeans_chain_task(
+    args: tuple[list[str | Path | np.ndarray], dict],
+) -> list[np.ndarray]:
+    # Warm-start every fit after the first from the centroids of the image before it. Known
+    # ranked palettes in the run aren't fitted again, they only seed the next fit
+    steps, kwargs = args
+    results: list[np.ndarray] = []
+    init_centroids: np.ndarray | None = None
+    for step in steps:
+        if isinstance(step, np.ndarray):
+            ranked_palette: np.ndarray = step
+        else:
+            ranked_palette = kmeans_rank(step, init_centroids=init_centroids, **kwargs)
+            results.append(ranked_palette)
+        init_centroids = _warm_start_centroids(ranked_palette, kwargs["n_clusters"])
+    return results
+
+
+def kmeans_batch(
+    filepaths: Iterable[str | Path],
+    n_clusters: int,
+    n_init: int | str = "auto",
+    random_state: int | None = None,
+    sample_size: int | None = None,
+    reduce_factor: int | None = None,
+    engine: str = "pixels",
+    color_space: str = "rgb",
+    max_workers: int | None = None,
+    warm_start: bool = False,
+    palettes: Sequence[np.ndarray | None] | None = None,
+) -> Iterator[np.ndarray]:
+    """
+    kmeans_batch Rank the palette of many images in a process pool
+
+    Palettes are ranked in the workers, so only the small ranked palettes are sent back instead
+    of a label for every pixel.
+
+    With `warm_start`, the images are split into consecutive runs of `WARM_START_CHUNK`, one per
+    task, and each fit in a run starts from the ranked centroids of the image before it. The runs
+    don't depend on `max_workers`, so an image gets the same palette on every machine. Pass the
+    covers in chronological order so neighbors share a design.
+
+    Args:
+        `filepaths` (Iterable[str | Path]): Image filepaths
+        `n_clusters` (int): Number of centroids
+        `n_init` (int | str): Number of k-means++ initializations
+        `random_state` (int | None): Seed for the centroid initialization and the pixel sample
+        `sample_size` (int | None): Number of pixels to fit on
+        `reduce_factor` (int | None): Integer downscaling factor of the image to fit on
+        `engine` (str): One of `pixels`, `unique`, `histogram` or `minibatch`
+        `color_space` (str): One of `rgb`, `lab` or `oklab`
+        `max_workers` (int | None): Number of processes. Defaults to the number of cores
+        `warm_start` (bool): Start each fit from the centroids of the previous image
+        `palettes` (Sequence[np.ndarray | None] | None): Ranked palettes already known for some of the images, e.g. from a cache. Those images aren't fitted, but still seed the next image of their run
+
+    Yields:
+        np.ndarray: output of rank_palette for each image without a known palette, in input order
+    """
+    kwargs: dict = dict(
+        n_clusters=n_clusters,
+        n_init=n_init,
+        random_state=random_state,
+        sample_size=sample_size,
+        reduce_factor=reduce_factor,
+        engine=engine,
+        color_space=color_space,
+    )
+    filepaths = list(filepaths)
+    palettes = list(palettes) if palettes is not None else [None] * len(filepaths)
+    n_fits: int = sum(palette is None for palette in palettes)
+    if not n_fits:
+        return
+    max_workers = min(max_workers or os.cpu_count() or 1, n_fits)
+
+    with ProcessPoolExecutor(
+        max_workers=max_workers, initializer=init_worker
+    ) as executor:
+        if not warm_start:
+            yield from executor.map(
+                _kmeans_task,
+                [
+                    (filepath, kwargs)
+                    for filepath, palette in zip(filepaths, palettes)
+                    if palette is None
+                ],
+            )
+            return
+        steps: list[str | Path | np.ndarray] = [
+            filepath if palette is None else palette
+            for filepath, palette in zip(filepaths, palettes)
+        ]
+        chains: list[tuple] = [
+            (steps[i : i + WARM_START_CHUNK], kwargs)
+            for i in range(0, len(steps), WARM_START_CHUNK)
+            if any(palette is None for palette in palettes[i : i + WARM_START_CHUNK])
+        ]
+        for results in executor.map(_kmeans_chain_task, chains):
+            yield from results
+
+
+SQUARE_COLOR_INDICES: tuple[int, ...] = (1, 0, 2, 6)
+
+PALETTE_DTYPE: np.dtype = np.dtype(
+    [
+        ("label", np.int32),
+        ("count", np.int64),
+        ("proportion", np.float32),
+        ("color", np.float32, (3,)),
+    ]
+)
+
+
+def _cluster_order(
+    color_labels: np.ndarray, sample_weight: np.ndarray | None, minlength: int = 0
+) -> tuple[np.ndarray, np.ndarray]:
+    counts: np.ndarray = np.bincount(
+        color_labels, weights=sample_weight, minlength=minlength
+    )
+    order: np.ndarray = np.argsort(-counts, kind="stable")
+    order = order[counts[order] > 0]
+    # Break ties by first appearance, like Counter.most_common. Only tied labels are searched for
+    tied: np.ndarray = order[1:][counts[order[1:]] == counts[order[:-1]]]
+    if len(tied):
+        tied = np.union1d(tied, order[:-1][counts[order[:-1]] == counts[order[1:]]])
+        first_seen: np.ndarray = np.zeros(len(counts), dtype=np.intp)
+        first_seen[tied] = [np.argmax(color_labels == label) for label in tied]
+        order = order[np.lexsort((first_seen[order], -counts[order]))]
+    return order, counts
+
+
+def rank_palette(
+    color_palette: np.ndarray,
+    color_labels: np.ndarray,
+    sample_weight: np.ndarray | None = None,
+) -> np.ndarray:
+    """
+    rank_palette Rank the KMeans clusters by size
 
     Args:
-        color_labels (np.ndarray): labels from kmeans_img function
+        color_palette (np.ndarray): centroids from kmeans_img or kmeans_colors function
+        color_labels (np.ndarray): labels from kmeans_img or kmeans_colors function
+        sample_weight (np.ndarray | None): pixel count of each label, e.g. the counts from kmeans_colors
 
     Returns:
-        list[tuple]: list of RGB values for each of the 4 colors
+        np.ndarray: structured array of `PALETTE_DTYPE` with one row per non-empty cluster, largest first
     """
+    order, counts = _cluster_order(color_labels, sample_weight, len(color_palette))
+    ranked: np.ndarray = np.empty(len(order), dtype=PALETTE_DTYPE)
+    ranked["label"] = order
+    ranked["count"] = counts[order]
+    ranked["proportion"] = counts[order] / counts.sum()
+    ranked["color"] = color_palette[order]
+    return ranked
+
 
-    color_indices: list[int] = [1, 0, 2, 6]
-    color_counter: list[tuple] = Counter(color_labels).most_common(10)
+def select_colors(
+    ranked_palette: np.ndarray, color_indices: tuple[int, ...] = SQUARE_COLOR_INDICES
+) -> np.ndarray:
+    """
+    select_colors Pick the colors of the square from a ranked palette
+
+    Args:
+        ranked_palette (np.ndarray): output of rank_palette
+        color_indices (tuple[int, ...]): ranks to pick, in drawing order
+
+    Returns:
+        np.ndarray: the selected rows of the ranked palette
+    """
+    _check_cluster_count(len(ranked_palette), color_indices)
+    return ranked_palette[list(color_indices)]
 
-    color_square_list: list[tuple] = [color_counter[i][0] for i in color_indices]
-    return color_square_list
+
+def _check_cluster_count(n_clusters: int, color_indices: tuple[int, ...]) -> None:
+    if n_clusters <= max(color_indices):
+        raise ValueError(
+            f"Picking ranks {list(color_indices)} needs at least {max(color_indices) + 1} "
+            f"non-empty clusters, but only {n_clusters} were found"
+        )
+
+
+def get_color_labels(
+    color_labels: np.ndarray,
+    sample_weight: np.ndarray | None = None,
+    color_indices: tuple[int, ...] = SQUARE_COLOR_INDICES,
+) -> list[int]:
+    """
+    get_color_labels Extract 4 colors from KMeans labels
+
+    Args:
+        color_labels (np.ndarray): labels from kmeans_img or kmeans_colors function
+        sample_weight (np.ndarray | None): pixel count of each label, e.g. the counts from kmeans_colors
+        color_indices (tuple[int, ...]): ranks to pick, in drawing order
+
+    Returns:
+        list[int]: list of centroid indices for each of the 4 colors
+    """
+    order, _ = _cluster_order(color_labels, sample_weight)
+    _check_cluster_count(len(order), color_indices)
+    return order[list(color_indices)].tolist()
@@ -0,0 +1,300 @@
+import cProfile
+import functools
+import inspect
+import json
+import os
+import sys
+import threading
+import time
+from collections.abc import Callable, Iterator
+from contextlib import contextmanager, nullcontext
+from dataclasses import asdict, dataclass
+from pathlib import Path
+
+PROFILE_DIR_ENV: str = "PIPELINE_PROFILE_DIR"
+
+
+def peak_rss(children: bool = False) -> int | None:
+    """
+    peak_rss Peak resident set size reported by `resource`
+
+    Args:
+        `children (bool)`: Report the largest of the finished child processes instead of this process
+
+    Returns:
+        `int | None`: Peak resident set size in bytes, or `None` on Windows
+    """
+    try:
+        import resource
+    except ImportError:
+        return None
+    usage = resource.getrusage(
+        resource.RUSAGE_CHILDREN if children else resource.RUSAGE_SELF
+    )
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    return usage.ru_maxrss * (1 if sys.platform == "darwin" else 1024)
+
+
+def current_rss() -> int | None:
+    """
+    current_rss Resident set size of this process in bytes
+
+    Reads `/proc/self/statm` on Linux. Elsewhere it falls back to the peak RSS reported by
+    `resource`, and to `None` on Windows.
+
+    Returns:
+        `int | None`: Resident set size in bytes
+    """
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, AttributeError):
+        return peak_rss()
+
+
+class MemorySampler:
+    """
+    MemorySampler Sample the resident set size on a background thread and keep the peak
+
+    Memory used by worker processes is not included.
+
+    Args:
+        `interval (float)`: Seconds between samples
+    """
+
+    def __init__(self, interval: float = 0.05) -> None:
+        self.interval: float = interval
+        self.peak: int | None = None
+        self._stop: threading.Event = threading.Event()
+        self._thread: threading.Thread | None = None
+
+    def sample(self) -> None:
+        rss: int | None = current_rss()
+        if rss is not None:
+            self.peak = rss if self.peak is None else max(self.peak, rss)
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.interval):
+            self.sample()
+
+    def __enter__(self) -> "MemorySampler":
+        self.sample()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self._stop.set()
+        self._thread.join()
+        self.sample()
+
+
+@dataclass
+class TimerStats:
+    count: int = 0
+    total: float = 0.0
+    max: float = 0.0
+    peak_rss: int | None = None
+
+    def add(self, seconds: float, peak_rss: int | None = None) -> None:
+        self.count += 1
+        self.total += seconds
+        self.max = max(self.max, seconds)
+        if peak_rss is not None:
+            self.peak_rss = max(self.peak_rss or 0, peak_rss)
+
+
+@dataclass
+class Timing:
+    elapsed: float = 0.0
+    peak_rss: int | None = None
+
+
+class Metrics:
+    """
+    Metrics Registry of timers and counters for the pipeline stages
+
+    Timers record the number of calls, total and slowest wall time and, when sampled, the peak
+    resident set size. Counters add up quantities such as bytes, images and pixels. Stages are
+    profiled with cProfile when `profile_dir` is set, or the `PIPELINE_PROFILE_DIR` environment
+    variable names a folder. Workers in process pools keep their own registry, so record their
+    results in the parent process.
+    """
+
+    def __init__(self) -> None:
+        self.timers: dict[str, TimerStats] = {}
+        self.counters: dict[str, float] = {}
+        self.profile_dir: Path | None = (
+            Path(os.environ[PROFILE_DIR_ENV]) if os.environ.get(PROFILE_DIR_ENV) else None
+        )
+        self._lock: threading.Lock = threading.Lock()
+
+    def count(self, name: str, value: float = 1) -> None:
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def observe(self, name: str, seconds: float, peak_rss: int | None = None) -> None:
+        with self._lock:
+            self.timers.setdefault(name, TimerStats()).add(seconds, peak_rss)
+
+    @contextmanager
+    def timer(self, name: str, sample_memory: bool = False) -> Iterator[Timing]:
+        """
+        timer Time a block of code
+
+        Args:
+            `name (str)`: Timer name, e.g. `download.file`
+            `sample_memory (bool)`: Also record the peak resident set size of the block
+
+        Yields:
+            `Timing`: Filled with the elapsed time and peak RSS once the block exits
+        """
+        timing: Timing = Timing()
+        sampler: MemorySampler | None = MemorySampler() if sample_memory else None
+        start_time: float = time.perf_counter()
+        try:
+            with sampler or nullcontext():
+                yield timing
+        finally:
+            timing.elapsed = time.perf_counter() - start_time
+            timing.peak_rss = sampler.peak if sampler else None
+            self.observe(name, timing.elapsed, timing.peak_rss)
+
+    def timed(self, name: str | None = None, sample_memory: bool = False) -> Callable:
+        """
+        timed Decorator that times every call of a function or coroutine function
+
+        Args:
+            `name (str | None)`: Timer name. Defaults to the module and function name
+            `sample_memory (bool)`: Also record the peak resident set size of each call
+
+        Returns:
+            `Callable`: Decorator
+        """
+
+        def decorator(func: Callable) -> Callable:
+            timer_name: str = name or f"{func.__module__}.{func.__qualname__}"
+
+            if inspect.iscoroutinefunction(func):
+
+                @functools.wraps(func)
+                async def async_wrapper(*args, **kwargs):
+                    with self.timer(timer_name, sample_memory):
+                        return await func(*args, **kwargs)
+
+                return async_wrapper
+
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                with self.timer(timer_name, sample_memory):
+                    return func(*args, **kwargs)
+
+            return wrapper
+
+        return decorator
+
+    @contextmanager
+    def profile(self, name: str) -> Iterator[None]:
+        """
+        profile Run a block under cProfile and dump the stats to `<profile_dir>/<name>.prof`. Does nothing without a `profile_dir`
+
+        Args:
+            `name (str)`: Name of the stats file
+        """
+        if self.profile_dir is None:
+            yield
+            return
+        profiler: cProfile.Profile = cProfile.Profile()
+        profiler.enable()
+        try:
+            yield
+        finally:
+            profiler.disable()
+            Path.mkdir(self.profile_dir, parents=True, exist_ok=True)
+            profiler.dump_stats(self.profile_dir / f"{name}.prof")
+
+    @contextmanager
+    def stage(self, name: str) -> Iterator[Timing]:
+        """
+        stage Time a pipeline stage with memory sampling, profiling it when enabled
+
+        Args:
+            `name (str)`: Stage name. The timer is named `stage.<name>`
+
+        Yields:
+            `Timing`: Filled with the elapsed time and peak RSS once the stage exits
+        """
+        with self.timer(f"stage.{name}", sample_memory=True) as timing, self.profile(name):
+            yield timing
+
+    def snapshot(self) -> list[dict]:
+        with self._lock:
+            return [
+                {"type": "timer", "name": name, **asdict(stats)}
+                for name, stats in self.timers.items()
+            ] + [
+                {"type": "counter", "name": name, "value": value}
+                for name, value in self.counters.items()
+            ]
+
+    def reset(self) -> None:
+        with self._lock:
+            self.timers.clear()
+            self.counters.clear()
+
+    def write_json_lines(self, output_file: Path) -> None:
+        """
+        write_json_lines Append one JSON object per metric, all stamped with the same time
+
+        Args:
+            `output_file (Path)`: JSON lines file
+        """
+        timestamp: float = time.time()
+        Path.mkdir(output_file.parent, parents=True, exist_ok=True)
+        with open(output_file, "a") as f:
+            for metric in self.snapshot():
+                f.write(json.dumps({"timestamp": timestamp, **metric}) + "\n")
+
+    def to_prometheus(self, prefix: str = "pipeline") -> str:
+        """
+        to_prometheus Render the metrics in the Prometheus text exposition format
+
+        Args:
+            `prefix (str)`: Prepended to every metric name
+
+        Returns:
+            `str`: Exposition text
+        """
+        lines: list[str] = []
+        for metric in self.snapshot():
+            name: str = f"{prefix}_{metric['name']}".replace(".", "_").replace("-", "_")
+            if metric["type"] == "counter":
+                lines += [f"# TYPE {name}_total counter", f"{name}_total {metric['value']}"]
+                continue
+            lines += [
+                f"# TYPE {name}_seconds summary",
+                f"{name}_seconds_sum {metric['total']}",
+                f"{name}_seconds_count {metric['count']}",
+                f"# TYPE {name}_max_seconds gauge",
+                f"{name}_max_seconds {metric['max']}",
+            ]
+            if metric["peak_rss"] is not None:
+                lines += [
+                    f"# TYPE {name}_peak_rss_bytes gauge",
+                    f"{name}_peak_rss_bytes {metric['peak_rss']}",
+                ]
+        return "\n".join(lines) + "\n"
+
+    def write_prometheus(self, output_file: Path) -> None:
+        Path.mkdir(output_file.parent, parents=True, exist_ok=True)
+        with open(output_file, "w") as f:
+            f.write(self.to_prometheus())
+
+
+# Registry shared by the whole pipeline
+METRICS: Metrics = Metrics()
+count = METRICS.count
+observe = METRICS.observe
+timer = METRICS.timer
+timed = METRICS.timed
+stage = METRICS.stage
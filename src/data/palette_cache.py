@@ -0,0 +1,163 @@
+import hashlib
+import inspect
+import json
+import os
+from collections.abc import Iterable, Iterator
+from pathlib import Path
+
+import kmeans as km
+import metrics as mt
+import numpy as np
+import palette_store as ps
+
+DEFAULT_CACHE_DIR: Path = Path.cwd() / "data" / "interim" / "palette-cache"
+# Per-call arguments of `kmeans.kmeans_img` that don't describe the palette
+_CALL_ARGUMENTS: tuple[str, ...] = ("filepath", "init_centroids", "return_n_iter")
+
+
+def normalize_params(kmeans_params: dict) -> dict:
+    """
+    normalize_params Fill in the defaults of `kmeans.kmeans_img` so equivalent parameters produce the same key
+
+    A fit that starts from the previous cover's centroids gives a different palette than a
+    k-means++ fit, so `warm_start` is kept when it is set.
+
+    Args:
+        `kmeans_params (dict)`: Keyword arguments for `kmeans.kmeans_img`, without `filepath`, and optionally `warm_start`
+
+    Returns:
+        `dict`: Every keyword argument of `kmeans.kmeans_img` that describes the palette, and `warm_start` when it is True
+    """
+    kmeans_params = dict(kmeans_params)
+    warm_start: bool = kmeans_params.pop("warm_start", False)
+    bound = inspect.signature(km.kmeans_img).bind(None, **kmeans_params)
+    bound.apply_defaults()
+    params: dict = {
+        name: value
+        for name, value in bound.arguments.items()
+        if name not in _CALL_ARGUMENTS
+    }
+    if warm_start:
+        params["warm_start"] = True
+    return params
+
+
+class PaletteCache:
+    """
+    PaletteCache On-disk cache of ranked palettes keyed by image content hash and kmeans parameters
+
+    Entries are small `.npy` files named after the key. Reading an entry marks it as recently
+    used, and the least recently used entries are evicted once the cache exceeds `max_bytes`.
+
+    Args:
+        `folder (Path)`: Cache folder
+        `max_bytes (int)`: Size bound of the cache folder
+    """
+
+    def __init__(self, folder: Path = DEFAULT_CACHE_DIR, max_bytes: int = 64 * 2**20):
+        self.folder: Path = folder
+        self.max_bytes: int = max_bytes
+        Path.mkdir(folder, parents=True, exist_ok=True)
+        self._size: int = sum(entry.stat().st_size for entry in folder.glob("*.npy"))
+        if self._size > self.max_bytes:
+            self.evict()
+
+    @staticmethod
+    def key(content_hash: str, kmeans_params: dict, seed_key: str | None = None) -> str:
+        # A warm-started palette also depends on the palette its fit started from
+        payload: str = json.dumps(
+            [content_hash, normalize_params(kmeans_params)]
+            + ([seed_key] if seed_key else []),
+            sort_keys=True,
+        )
+        return hashlib.sha256(payload.encode()).hexdigest()
+
+    def get(self, key: str) -> np.ndarray | None:
+        entry: Path = self.folder / f"{key}.npy"
+        try:
+            ranked_palette: np.ndarray = np.load(entry)
+        except FileNotFoundError:
+            return None
+        os.utime(entry)
+        return ranked_palette
+
+    def put(self, key: str, ranked_palette: np.ndarray) -> None:
+        entry: Path = self.folder / f"{key}.npy"
+        # Kept off the `*.npy` glob, so a crash mid-write can't leave a readable half entry
+        tmp_entry: Path = self.folder / f"{key}.npy.tmp"
+        with open(tmp_entry, "wb") as f:
+            np.save(f, ranked_palette)
+        if entry.exists():
+            self._size -= entry.stat().st_size
+        os.replace(tmp_entry, entry)
+        self._size += entry.stat().st_size
+        if self._size > self.max_bytes:
+            self.evict()
+
+    def evict(self) -> None:
+        entries: list[tuple[float, int, Path]] = sorted(
+            (stat.st_mtime, stat.st_size, entry)
+            for entry in self.folder.glob("*.npy")
+            for stat in [entry.stat()]
+        )
+        self._size = sum(size for _, size, _ in entries)
+        for _, size, entry in entries:
+            if self._size <= self.max_bytes:
+                break
+            entry.unlink(missing_ok=True)
+            self._size -= size
+
+
+def cached_palettes(
+    filepaths: Iterable[str | Path],
+    cache: PaletteCache,
+    max_workers: int | None = None,
+    warm_start: bool = False,
+    **kmeans_params,
+) -> Iterator[tuple[str | Path, str, np.ndarray, bool]]:
+    """
+    cached_palettes Rank the palette of every image, clustering only the images missing from the cache
+
+    Args:
+        `filepaths (Iterable[str | Path])`: Image filepaths or `pixel_archive.ArchiveEntry` references
+        `cache (PaletteCache)`: Palette cache
+        `max_workers (int | None)`: Number of processes for the cache misses
+        `warm_start (bool)`: Start each fit from the centroids of the previous cover, cached or not. Pass the covers in chronological order. A warm-started palette is keyed on the cover and the key of the cover before it in its run of `kmeans.WARM_START_CHUNK`
+        `**kmeans_params`: Keyword arguments for `kmeans.kmeans_img`
+
+    Yields:
+        `tuple[str | Path, str, np.ndarray, bool]`: filepath, content hash, ranked palette and whether it came from the cache. Hits are yielded first, then misses as they finish
+    """
+    filepaths = list(filepaths)
+    misses: list[tuple[str | Path, str, str]] = []
+    palettes: list[np.ndarray | None] = []
+    key: str | None = None
+    for i, filepath in enumerate(filepaths):
+        # Archive entries carry the hash of their source file and working size
+        content_hash: str = getattr(filepath, "content_hash", None) or ps.file_sha256(
+            filepath
+        )
+        # Chaining the keys of a warm-started run makes a hit imply the same seeds before it
+        seed_key: str | None = key if warm_start and i % km.WARM_START_CHUNK else None
+        key = cache.key(content_hash, {**kmeans_params, "warm_start": warm_start}, seed_key)
+        ranked_palette: np.ndarray | None = cache.get(key)
+        palettes.append(ranked_palette)
+        if ranked_palette is None:
+            misses.append((filepath, content_hash, key))
+        else:
+            mt.count("fit.cache_hits")
+            yield filepath, content_hash, ranked_palette, True
+
+    # Cached covers aren't fitted again, but still seed the warm start of the next cover
+    results = km.kmeans_batch(
+        filepaths,
+        max_workers=max_workers,
+        warm_start=warm_start,
+        palettes=palettes,
+        **kmeans_params,
+    )
+    for (filepath, content_hash, key), ranked_palette in zip(misses, results):
+        cache.put(key, ranked_palette)
+        mt.count("fit.images")
+        mt.count("fit.pixels", int(ranked_palette["count"].sum()))
+        yield filepath, content_hash, ranked_palette, False
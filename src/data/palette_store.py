@@ -0,0 +1,155 @@
+import hashlib
+import json
+from pathlib import Path
+from types import TracebackType
+
+import numpy as np
+import polars as pl
+
+PALETTE_SCHEMA: dict[str, pl.DataType] = {
+    "filename": pl.String,
+    "year": pl.Int16,
+    "month": pl.Int8,
+    "centroids": pl.List(pl.Array(pl.Float32, 3)),
+    "proportions": pl.List(pl.Float32),
+    "kmeans_params": pl.String,
+    "content_hash": pl.String,
+}
+
+
+def file_sha256(filepath: str | Path) -> str:
+    """
+    file_sha256 Return the SHA-256 hex digest of a file's contents
+
+    Args:
+        `filepath (str | Path)`: File to hash
+
+    Returns:
+        `str`: Hex digest
+    """
+    sha256 = hashlib.sha256()
+    with open(filepath, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            sha256.update(block)
+    return sha256.hexdigest()
+
+
+def palette_record(
+    filename: str,
+    ranked_palette: np.ndarray,
+    kmeans_params: dict,
+    content_hash: str,
+    year: int | None = None,
+    month: int | None = None,
+) -> dict:
+    """
+    palette_record Build one row of the palette table
+
+    Args:
+        `filename (str)`: Magazine filename key, e.g. `2020_1_2`
+        `ranked_palette (np.ndarray)`: Output of `kmeans.rank_palette`, largest cluster first
+        `kmeans_params (dict)`: Keyword arguments the palette was fitted with
+        `content_hash (str)`: SHA-256 of the source image
+        `year (int | None)`: Issue year
+        `month (int | None)`: Issue start month
+
+    Returns:
+        `dict`: Row matching `PALETTE_SCHEMA`
+    """
+    return {
+        "filename": filename,
+        "year": year,
+        "month": month,
+        "centroids": ranked_palette["color"].tolist(),
+        "proportions": ranked_palette["proportion"].tolist(),
+        "kmeans_params": json.dumps(kmeans_params, sort_keys=True),
+        "content_hash": content_hash,
+    }
+
+
+class PaletteStore:
+    """
+    PaletteStore Append palette rows to a folder of Parquet files as they are produced
+
+    Every `row_group_size` rows are written out as a new `part-NNNNN.parquet` file, so the table
+    grows while clustering runs and a crash loses at most one unwritten group. Read the whole table
+    back with `scan_palettes`.
+
+    Args:
+        `folder (Path)`: Folder holding the Parquet parts
+        `row_group_size (int)`: Number of rows buffered before a part is written
+    """
+
+    def __init__(self, folder: Path, row_group_size: int = 32) -> None:
+        self.folder: Path = folder
+        self.row_group_size: int = row_group_size
+        self._rows: list[dict] = []
+        Path.mkdir(folder, parents=True, exist_ok=True)
+        self._next_part: int = 1 + max(
+            (int(part.stem.removeprefix("part-")) for part in folder.glob("part-*.parquet")),
+            default=-1,
+        )
+
+    def append(self, record: dict) -> None:
+        self._rows.append(record)
+        if len(self._rows) >= self.row_group_size:
+            self.flush()
+
+    def flush(self) -> None:
+        if not self._rows:
+            return
+        part: Path = self.folder / f"part-{self._next_part:05d}.parquet"
+        pl.DataFrame(self._rows, schema=PALETTE_SCHEMA).write_parquet(part)
+        self._next_part += 1
+        self._rows = []
+
+    def close(self) -> None:
+        self.flush()
+
+    def __enter__(self) -> "PaletteStore":
+        return self
+
+    def __exit__(
+        self,
+        exc_type: type[BaseException] | None,
+        exc: BaseException | None,
+        traceback: TracebackType | None,
+    ) -> None:
+        self.close()
+
+
+def scan_palettes(folder: Path) -> pl.LazyFrame:
+    """
+    scan_palettes Lazily scan the palette table. When a file was clustered more than once, only its latest row is kept
+
+    Args:
+        `folder (Path)`: Folder holding the Parquet parts
+
+    Returns:
+        `pl.LazyFrame`: Polars LazyFrame following `PALETTE_SCHEMA`
+    """
+    return pl.scan_parquet(folder / "part-*.parquet").unique(
+        subset=["filename", "kmeans_params"], keep="last", maintain_order=True
+    )
+
+
+def stored_keys(folder: Path, kmeans_params: dict) -> set[tuple[str, str]]:
+    """
+    stored_keys Return the (filename, content hash) of every palette already stored with the same parameters
+
+    Args:
+        `folder (Path)`: Folder holding the Parquet parts
+        `kmeans_params (dict)`: Keyword arguments the palettes were fitted with
+
+    Returns:
+        `set[tuple[str, str]]`: Stored (filename, content_hash) pairs. Empty when nothing is stored yet
+    """
+    if not any(folder.glob("part-*.parquet")):
+        return set()
+    return set(
+        scan_palettes(folder)
+        .filter(pl.col("kmeans_params") == json.dumps(kmeans_params, sort_keys=True))
+        .select("filename", "content_hash")
+        .collect()
+        .iter_rows()
+    )
@@ -0,0 +1,255 @@
+import hashlib
+import json
+import os
+from collections.abc import Iterable
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from pathlib import Path
+
+import image_io as imio
+import numpy as np
+import palette_store as ps
+
+ARCHIVE_FILEPATH: Path = Path.cwd() / "data" / "interim" / "pixel-archive"
+PIXELS_FILENAME: str = "pixels.npy"
+INDEX_FILENAME: str = "index.json"
+# Height of the gif frame images, with the aspect ratio of the covers
+WORKING_SIZE: tuple[int, int] = (773, 1000)
+
+# Archives opened by this process, so workers map each file once
+_open_archives: dict[Path, tuple[int, "PixelArchive"]] = {}
+
+
+@dataclass(frozen=True)
+class ArchiveEntry:
+    """
+    ArchiveEntry Picklable reference to one cover in a pixel archive
+
+    Workers resolve it by mapping the archive themselves, so the pixels are shared through the
+    page cache instead of being copied into every process. `image_io` and `kmeans` accept it
+    anywhere they accept a filepath.
+
+    Args:
+        `folder (Path)`: Archive folder
+        `filename (str)`: Cover filename, without suffix
+        `content_hash (str)`: Hash of the source file and the working size
+    """
+
+    folder: Path
+    filename: str
+    content_hash: str
+
+    def image_array(self) -> np.ndarray:
+        return open_archive(self.folder).image_array(self.filename)
+
+
+class PixelArchive:
+    """
+    PixelArchive Read-only view of every cover, decoded at one working size into a single memory-mapped uint8 array
+
+    The pixels are stored as an `(n, height, width, 3)` `.npy` file, next to a JSON index from
+    filename to row.
+
+    Args:
+        `folder (Path)`: Archive folder written by `build_archive`
+    """
+
+    def __init__(self, folder: Path = ARCHIVE_FILEPATH) -> None:
+        self.folder: Path = folder
+        with open(folder / INDEX_FILENAME) as f:
+            index: dict = json.load(f)
+        self.size: tuple[int, int] = tuple(index["size"])
+        self.files: dict[str, dict] = index["files"]
+        self.pixels: np.ndarray = np.load(folder / PIXELS_FILENAME, mmap_mode="r")
+
+    def __len__(self) -> int:
+        return len(self.files)
+
+    def __contains__(self, filename: str) -> bool:
+        return filename in self.files
+
+    def image_array(self, filename: str) -> np.ndarray:
+        """
+        image_array Zero-copy `(height, width, 3)` view of one cover
+
+        Args:
+            `filename (str)`: Cover filename, without suffix
+
+        Returns:
+            `np.ndarray`: Read-only uint8 view into the memory map
+        """
+        return self.pixels[self.files[filename]["row"]]
+
+    def entry(self, filename: str) -> ArchiveEntry:
+        return ArchiveEntry(self.folder, filename, self.files[filename]["archive_hash"])
+
+    def close(self) -> None:
+        # Drop the memory map, so the pixels file can be replaced on every platform
+        self.pixels = np.empty((0, self.size[1], self.size[0], 3), dtype=np.uint8)
+
+
+def file_stat(filepath: str | Path) -> list[int]:
+    stat = Path(filepath).stat()
+    return [stat.st_size, stat.st_mtime_ns]
+
+
+def content_hash(filepath: str | Path, entry: dict | None = None) -> str:
+    """
+    content_hash Hash a cover, reusing the hash in its index entry while its size and modification time are unchanged
+
+    Args:
+        `filepath (str | Path)`: Cover filepath
+        `entry (dict | None)`: The cover's entry in an archive index
+
+    Returns:
+        `str`: SHA-256 of the file contents
+    """
+    if entry is not None and entry.get("stat") == file_stat(filepath):
+        return entry["content_hash"]
+    return ps.file_sha256(filepath)
+
+
+def open_archive(folder: Path = ARCHIVE_FILEPATH) -> PixelArchive:
+    """
+    open_archive Open an archive once per process, reopening it after it is rebuilt
+
+    Args:
+        `folder (Path)`: Archive folder
+
+    Returns:
+        `PixelArchive`: Shared archive
+    """
+    mtime: int = (folder / INDEX_FILENAME).stat().st_mtime_ns
+    cached: tuple[int, PixelArchive] | None = _open_archives.get(folder)
+    if cached is None or cached[0] != mtime:
+        _open_archives[folder] = (mtime, PixelArchive(folder))
+    return _open_archives[folder][1]
+
+
+def archive_sources(
+    filepaths: Iterable[str | Path], folder: Path = ARCHIVE_FILEPATH
+) -> list[str | Path | ArchiveEntry]:
+    """
+    archive_sources Swap every file that is in the archive, unchanged, for its archive entry
+
+    Only covers whose size or modification time changed since the archive was built are hashed.
+
+    Args:
+        `filepaths (Iterable[str | Path])`: Cover filepaths
+        `folder (Path)`: Archive folder
+
+    Returns:
+        `list[str | Path | ArchiveEntry]`: Archive entries, or the filepath when the cover is missing from the archive
+    """
+    filepaths = list(filepaths)
+    if not (folder / INDEX_FILENAME).exists():
+        return filepaths
+    archive: PixelArchive = open_archive(folder)
+    sources: list[str | Path | ArchiveEntry] = []
+    for filepath in filepaths:
+        entry: dict | None = archive.files.get(Path(filepath).stem)
+        if entry is not None and content_hash(filepath, entry) == entry["content_hash"]:
+            sources.append(archive.entry(Path(filepath).stem))
+        else:
+            sources.append(filepath)
+    return sources
+
+
+def archive_frame_paths(
+    frame_paths: Iterable[tuple[str | Path, str | Path]], folder: Path = ARCHIVE_FILEPATH
+) -> list[tuple[str | Path | ArchiveEntry, str | Path]]:
+    """
+    archive_frame_paths Swap the cover of every (cover, square) pair for its archive entry when it is archived and unchanged
+
+    Args:
+        `frame_paths (Iterable[tuple[str | Path, str | Path]])`: (cover, square) paths from `gif_maker.get_frame_paths`
+        `folder (Path)`: Archive folder
+
+    Returns:
+        `list[tuple[str | Path | ArchiveEntry, str | Path]]`: (cover, square) pairs in the same order
+    """
+    frame_paths = list(frame_paths)
+    return list(
+        zip(
+            archive_sources((cover for cover, _ in frame_paths), folder),
+            (square for _, square in frame_paths),
+        )
+    )
+
+
+def build_archive(
+    filepaths: Iterable[str | Path],
+    folder: Path = ARCHIVE_FILEPATH,
+    size: tuple[int, int] = WORKING_SIZE,
+    max_workers: int | None = None,
+) -> PixelArchive:
+    """
+    build_archive Decode every cover once at `size` into the pixel archive
+
+    Covers already in the archive with the same content and size are copied from it instead of
+    decoded again. JPEGs are decoded with draft mode on a thread pool, since Pillow releases the
+    GIL while decoding and resizing.
+
+    Args:
+        `filepaths (Iterable[str | Path])`: Cover filepaths, in the order of the rows
+        `folder (Path)`: Archive folder
+        `size (tuple[int, int])`: Working width and height of every cover
+        `max_workers (int | None)`: Number of decoding threads
+
+    Returns:
+        `PixelArchive`: The rebuilt archive
+    """
+    filepaths = list(filepaths)
+    old: PixelArchive | None = None
+    if (folder / INDEX_FILENAME).exists() and (folder / PIXELS_FILENAME).exists():
+        old = PixelArchive(folder)
+
+    files: dict[str, dict] = {}
+    for row, filepath in enumerate(filepaths):
+        stem: str = Path(filepath).stem
+        file_hash: str = content_hash(filepath, old.files.get(stem) if old else None)
+        files[stem] = {
+            "row": row,
+            "content_hash": file_hash,
+            "stat": file_stat(filepath),
+            "archive_hash": hashlib.sha256(
+                f"{file_hash}:{size[0]}x{size[1]}".encode()
+            ).hexdigest(),
+        }
+
+    if old is not None and old.size == size and old.files == files:
+        print("Pixel archive is up to date")
+        return old
+
+    def load(filepath: str | Path) -> np.ndarray:
+        stem: str = Path(filepath).stem
+        if (
+            old is not None
+            and old.size == size
+            and old.files.get(stem, {}).get("content_hash") == files[stem]["content_hash"]
+        ):
+            return old.image_array(stem)
+        return np.asarray(imio.load_image(filepath, size))
+
+    Path.mkdir(folder, parents=True, exist_ok=True)
+    temp_filepath: Path = folder / f"{PIXELS_FILENAME}.part"
+    pixels: np.memmap = np.lib.format.open_memmap(
+        temp_filepath, mode="w+", dtype=np.uint8, shape=(len(filepaths), size[1], size[0], 3)
+    )
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        for row, image_array in enumerate(executor.map(load, filepaths)):
+            pixels[row] = image_array
+    pixels.flush()
+    # Close every map of the file before it is replaced
+    del pixels
+    for archive in (old, _open_archives.pop(folder, (None, None))[1]):
+        if archive is not None:
+            archive.close()
+
+    os.replace(temp_filepath, folder / PIXELS_FILENAME)
+    temp_index: Path = folder / f"{INDEX_FILENAME}.part"
+    with open(temp_index, "w") as f:
+        json.dump({"size": list(size), "files": files}, f)
+    os.replace(temp_index, folder / INDEX_FILENAME)
+    print(f"Wrote {len(filepaths)} covers at {size[0]}x{size[1]} to {folder}")
+    return PixelArchive(folder)
@@ -0,0 +1,76 @@
+import argparse
+import time
+from collections.abc import Callable
+
+import color_index as cx
+import cover_index as ci
+import numpy as np
+import polars as pl
+
+
+def parse_color(color: str) -> np.ndarray:
+    """
+    parse_color Read a color given as `#rrggbb` or `r,g,b`
+
+    Args:
+        `color (str)`: Hex or comma separated sRGB color
+
+    Returns:
+        `np.ndarray`: sRGB color in [0, 255]
+    """
+    if "," in color:
+        return np.array([float(channel) for channel in color.split(",")], dtype=np.float32)
+    color = color.lstrip("#")
+    return np.array([int(color[i : i + 2], 16) for i in (0, 2, 4)], dtype=np.float32)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Query the stored palettes by color, by year or by palette similarity"
+    )
+    parser.add_argument("--color", type=parse_color, help="Covers closest to #rrggbb or r,g,b")
+    parser.add_argument("--max-delta-e", type=float, default=None)
+    parser.add_argument("--min-proportion", type=float, default=0.0)
+    parser.add_argument("--similar", metavar="FILENAME", help="Covers with the closest palette")
+    parser.add_argument("--years", action="store_true", help="Share of each global color per year")
+    parser.add_argument("-k", type=int, default=10)
+    parser.add_argument("--n-clusters", type=int, default=10)
+    parser.add_argument("--n-colors", type=int, default=cx.DEFAULT_GLOBAL_COLORS)
+    args = parser.parse_args()
+
+    start_time: float = time.perf_counter()
+    color_index: cx.ColorIndex = cx.ColorIndex.from_store(
+        ci.PALETTE_FILEPATH, {"n_clusters": args.n_clusters}, n_colors=args.n_colors
+    )
+    print(
+        f"Indexed {len(color_index.centroid_lab)} colors of {color_index.covers.height} covers "
+        f"in {time.perf_counter() - start_time:.2f}s"
+    )
+
+    queries: list[tuple[str, Callable]] = []
+    if args.color is not None:
+        queries.append(
+            (
+                "Nearest covers",
+                lambda: color_index.nearest_covers(
+                    args.color, args.k, args.max_delta_e, args.min_proportion
+                ),
+            )
+        )
+    if args.similar:
+        queries.append(
+            ("Similar covers", lambda: color_index.similar_covers(args.similar, args.k))
+        )
+    if args.years:
+        queries.append(("Year proportions", color_index.year_proportions))
+
+    with pl.Config(tbl_rows=-1):
+        for name, query in queries:
+            start_time = time.perf_counter()
+            result: pl.DataFrame = query()
+            print(f"{name} ({(time.perf_counter() - start_time) * 1000:.1f}ms)")
+            print(result)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,11 +1,13 @@
+import argparse
 import asyncio
 from dataclasses import dataclass, field
 
+import cover_index as ci
 import gather_magazines as gm
 import httpx
+import metrics as mt
 import polars as pl
-from playwright.async_api import async_playwright
-from selectolax.parser import HTMLParser
+import scrapers
 
 
 @dataclass
@@ -14,36 +16,82 @@ class Magazine:
     image_link: str | None = field(metadata={"dtype": pl.String})
 
 
-async def main():
-    async with async_playwright() as p:
-        browser = await p.chromium.launch()
-        page = await browser.new_page()
+@mt.timed("scrape.update_metadata")
+async def update_metadata(
+    client: httpx.AsyncClient, full: bool = False, backend: str = "httpx"
+) -> pl.DataFrame:
+    """
+    update_metadata Scrape the listing and add the new issues to the stored magazine metadata
 
-        base_url: str = "https://www.americastestkitchen.com/cooksillustrated/magazines"
+    Args:
+        `client (httpx.AsyncClient)`: httpx AsyncClient
+        `full (bool)`: Load the whole catalogue instead of stopping at the first stored issue
+        `backend (str)`: `httpx` or `playwright`
 
-        await page.goto(base_url)
-        await asyncio.sleep(1)
-        print("Visiting America's Test Kitchen")
+    Returns:
+        `pl.DataFrame`: The new issues, cleaned with `clean_df_name`
+    """
+    magazine_covers: pl.DataFrame | None = None
+    known_names: set[str] = set()
+    if ci.MAGAZINE_FILEPATH.exists():
+        magazine_covers = ci.read_magazines(include_blank=True)
+        if not full:
+            known_names = set(magazine_covers.get_column("name").to_list())
 
-        load_more_button = page.locator("button.Button-module_fill__UsoCz")
+    results: list[Magazine] = [
+        item
+        for item in await scrapers.scrape_with_fallback(client, known_names, backend)
+        if item.name not in known_names
+    ]
+    dtype_dict: dict[str, str] = gm.gather_dtype(Magazine)
+    new_covers: pl.DataFrame = gm.clean_df_name(
+        pl.from_records(results, schema=dtype_dict)
+    )
+    if not results:
+        print("No new issues found")
+        return new_covers
 
-        while await load_more_button.count() > 0:
-            await page.click("button.Button-module_fill__UsoCz")
+    if magazine_covers is not None:
+        magazine_covers = gm.merge_magazines(new_covers, magazine_covers)
+    else:
+        magazine_covers = new_covers
+    magazine_covers.write_parquet(ci.MAGAZINE_FILEPATH)
+    mt.count("scrape.new_issues", new_covers.height)
+    print(f"Found {new_covers.height} new issues")
+    return new_covers
 
-        page_text: HTMLParser = HTMLParser(await page.content())
-        await browser.close()
 
-        results: list[Magazine] = []
-        for item in gm.parse_item(page_text):
-            results.append(item)
+async def main():
+    parser = argparse.ArgumentParser(description="Scrape and download the magazine covers")
+    parser.add_argument(
+        "--full",
+        action="store_true",
+        help="Load the whole catalogue instead of stopping at the first stored issue",
+    )
+    parser.add_argument(
+        "--backend",
+        choices=["httpx", "playwright"],
+        default="httpx",
+        help="Scrape over plain HTTP (falls back to Playwright) or with headless Chromium",
+    )
+    args = parser.parse_args()
 
-        dtype_dict: dict[str, str] = gm.gather_dtype(Magazine)
-        magazine_covers: pl.DataFrame = pl.from_records(results, schema=dtype_dict)
-        magazine_covers: pl.DataFrame = gm.clean_df_name(magazine_covers)
-        magazine_covers.write_csv("./data/raw/magazine_covers.csv")
+    max_concurrency: int = 8
+    async with httpx.AsyncClient(
+        http2=True, limits=httpx.Limits(max_connections=max_concurrency)
+    ) as client:
+        await update_metadata(client, full=args.full, backend=args.backend)
+        if not ci.MAGAZINE_FILEPATH.exists():
+            return
 
-    async with httpx.AsyncClient(http2=True) as client:
-        await gm.download_images(magazine_covers, client)
+        # Every stored issue is passed so covers that failed or were interrupted on an
+        # earlier run are retried. Covers in the download manifest are only revalidated
+        await gm.download_images(
+            ci.read_magazines(),
+            client,
+            max_concurrency=max_concurrency,
+            requests_per_second=20,
+        )
 
 
 if __name__ == "__main__":
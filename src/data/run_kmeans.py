@@ -1,30 +1,29 @@
+import argparse
 from pathlib import Path
 
+import color_squares as sq
+import cover_index as ci
 import kmeans as km
-import matplotlib.pyplot as plt
+import palette_cache as pc
+import palette_store as ps
+import pixel_archive as pa
 import polars as pl
-from PIL import Image, ImageDraw
 
 
 def main():
-    image_filepath: Path = Path.cwd() / "data" / "raw" / "cooks-illustrated"
-
-    # tuple of (filepath and file stem) - filepath is for kmeans and file stem is for filtering on the below magazine dataframe
-    files: list[tuple[str, str]] = [
-        (str(path), path.stem) for path in image_filepath.rglob("*") if path.is_file()
-    ]
-
-    magazine_filepath: Path = Path.cwd() / "data" / "raw" / "magazine_covers.csv"
-    magazine_covers: pl.DataFrame = (
-        pl.read_csv(magazine_filepath)
-        .filter(pl.col.is_blank_cover != 1)
-        .select(pl.exclude("is_blank_cover"))
+    parser = argparse.ArgumentParser(
+        description="Cluster every cover and save its KMeans color square"
+    )
+    parser.add_argument(
+        "--archive",
+        action="store_true",
+        help="Read the covers that are in the pixel archive from it, at its working size",
     )
+    args = parser.parse_args()
 
-    filtered_magazines: list[str] = magazine_covers.get_column("filename").to_list()
-    filtered_files: list[str] = [
-        file[0] for file in files if file[1] in filtered_magazines
-    ]
+    cover_index: pl.DataFrame = ci.build_cover_index(palette_filepath=None)
+    filtered_files: list[str] = ci.cover_paths(cover_index)
+    covers: dict[str, dict] = ci.cover_lookup(cover_index)
 
     kmeans_folder: str = input(
         str("Name the folder where the KMeans color squares will be stored: ")
@@ -33,58 +32,37 @@ def main():
     Path.mkdir(color_square_filepath, exist_ok=True)
     print(f"Segmented images will be saved here: {color_square_filepath}")
 
-    for file in filtered_files:
-        if (
-            Path(f"{color_square_filepath}/{Path(file).stem}-square.webp").exists()
-            is True
-        ):
-            continue
-        else:
-            color_palette, color_labels = km.kmeans_img(filepath=file, n_clusters=10)
-
-            color_square_list: list = km.get_color_labels(color_labels)
-
-            image: Image.Image = Image.new("RGB", (200, 200), "white")
-            draw = ImageDraw.Draw(image)
+    kmeans_params: dict = pc.normalize_params({"n_clusters": 10})
+    palette_cache: pc.PaletteCache = pc.PaletteCache()
+    # Archived covers are clustered at the working size, so only read them when asked
+    sources: list = pa.archive_sources(filtered_files) if args.archive else filtered_files
+    source_files: dict = dict(zip(sources, filtered_files))
 
-            # Define the coordinates for the big square
-            big_square_coords: tuple[int, int, int, int] = (0, 0, 200, 200)
+    # Cache hits are stored too, unless the table already has the same palette
+    stored: set[tuple[str, str]] = ps.stored_keys(ci.PALETTE_FILEPATH, kmeans_params)
 
-            # Define the coordinates for the three inner squares
-            inner_square1_coords: tuple[int, int, int, int] = (25, 25, 100, 175)
-            inner_square2_coords: tuple[int, int, int, int] = (100, 25, 175, 100)
-            inner_square3_coords: tuple[int, int, int, int] = (100, 100, 175, 175)
-
-            # Draw the big square
-            draw.rectangle(
-                big_square_coords,
-                fill=tuple(color_palette[color_square_list[0]].astype(int)),
-            )
-
-            # Draw the three inner squares
-            draw.rectangle(
-                inner_square1_coords,
-                fill=tuple(color_palette[color_square_list[1]].astype(int)),
-            )
-            draw.rectangle(
-                inner_square2_coords,
-                fill=tuple(color_palette[color_square_list[2]].astype(int)),
-            )
-            draw.rectangle(
-                inner_square3_coords,
-                fill=tuple(color_palette[color_square_list[3]].astype(int)),
-            )
-
-            # Display the image
-            plt.imshow(image)
-            plt.axis("off")
-
-            plt.savefig(
-                f"{color_square_filepath}/{Path(file).stem}-square.webp",
-                bbox_inches="tight",
-                pad_inches=0,
-                dpi=300,
-            )
+    with ps.PaletteStore(ci.PALETTE_FILEPATH) as palette_store:
+        for source, content_hash, ranked_palette, cached in pc.cached_palettes(
+            sources, palette_cache, **kmeans_params
+        ):
+            file: str = source_files[source]
+            if (Path(file).stem, content_hash) not in stored:
+                cover: dict = covers[Path(file).stem]
+                palette_store.append(
+                    ps.palette_record(
+                        filename=Path(file).stem,
+                        ranked_palette=ranked_palette,
+                        kmeans_params=kmeans_params,
+                        content_hash=content_hash,
+                        year=cover["year"],
+                        month=cover["start_month_num"],
+                    )
+                )
+
+            square_filepath: Path = color_square_filepath / f"{Path(file).stem}-square.webp"
+            if cached and square_filepath.exists():
+                continue
+            sq.save_square(km.select_colors(ranked_palette)["color"], square_filepath)
     print("Finished exporting all files")
 
 
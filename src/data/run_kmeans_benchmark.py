@@ -0,0 +1,120 @@
+import argparse
+import time
+from pathlib import Path
+
+import color_conversion as cc
+import kmeans as km
+import numpy as np
+from scipy.optimize import linear_sum_assignment
+
+
+def palette_drift(palette: np.ndarray, reference: np.ndarray) -> np.ndarray:
+    """
+    palette_drift ΔE between each reference centroid and its matched centroid in another palette
+
+    Args:
+        `palette (np.ndarray)`: `(k, 3)` RGB centroids to compare
+        `reference (np.ndarray)`: `(k, 3)` RGB centroids of the full-pixel fit
+
+    Returns:
+        `np.ndarray`: ΔE per matched centroid pair
+    """
+    cost: np.ndarray = cc.delta_e(reference[:, None, :], palette[None, :, :])
+    rows, cols = linear_sum_assignment(cost)
+    return cost[rows, cols]
+
+
+def chronological(path: Path) -> tuple:
+    # Cover files are named year_startmonth_endmonth, e.g. 2015_11_12.jpg
+    parts: list[str] = path.stem.split("_")
+    if all(part.isdigit() for part in parts):
+        return (tuple(int(part) for part in parts), "")
+    return ((), path.stem)
+
+
+def square_colors(color_palette: np.ndarray, color_labels: np.ndarray) -> np.ndarray:
+    return color_palette[km.get_color_labels(color_labels)]
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Compare the fast k-means modes, engines and color spaces against the full-pixel fit"
+    )
+    parser.add_argument(
+        "folder",
+        nargs="?",
+        type=Path,
+        default=Path.cwd() / "data" / "raw" / "cooks-illustrated",
+    )
+    parser.add_argument("--limit", type=int, default=10)
+    parser.add_argument("--n-clusters", type=int, default=10)
+    parser.add_argument("--sample-size", type=int, default=50_000)
+    parser.add_argument("--reduce-factor", type=int, default=4)
+    args = parser.parse_args()
+
+    files: list[Path] = sorted(args.folder.glob("*.jpg"), key=chronological)[: args.limit]
+    modes: dict[str, dict] = {
+        "full": {},
+        f"sample={args.sample_size}": {"sample_size": args.sample_size},
+        f"reduce={args.reduce_factor}": {"reduce_factor": args.reduce_factor},
+        "unique": {"engine": "unique"},
+        "histogram": {"engine": "histogram"},
+        "lab": {"color_space": "lab"},
+        "oklab": {"color_space": "oklab"},
+        "histogram+oklab": {"engine": "histogram", "color_space": "oklab"},
+        "minibatch": {"engine": "minibatch"},
+        # Start from the centroids of the previous cover in the same mode
+        "warm": {"warm_start": True},
+        "minibatch+warm": {"engine": "minibatch", "warm_start": True},
+    }
+
+    timings: dict[str, list[float]] = {mode: [] for mode in modes}
+    palette_drifts: dict[str, list[float]] = {mode: [] for mode in modes}
+    square_drifts: dict[str, list[float]] = {mode: [] for mode in modes}
+    iterations: dict[str, list[int]] = {mode: [] for mode in modes}
+    previous_palettes: dict[str, np.ndarray] = {}
+
+    for file in files:
+        reference: tuple[np.ndarray, np.ndarray] | None = None
+        for mode, kwargs in modes.items():
+            kwargs = dict(kwargs)
+            if kwargs.pop("warm_start", False):
+                kwargs["init_centroids"] = previous_palettes.get(mode)
+            start_time: float = time.perf_counter()
+            color_palette, color_labels, n_iter = km.kmeans_img(
+                file, n_clusters=args.n_clusters, random_state=0, return_n_iter=True, **kwargs
+            )
+            timings[mode].append(time.perf_counter() - start_time)
+            iterations[mode].append(n_iter)
+            previous_palettes[mode] = color_palette
+
+            if reference is None:
+                reference = (color_palette, square_colors(color_palette, color_labels))
+            palette_drifts[mode].extend(palette_drift(color_palette, reference[0]))
+            square_drifts[mode].extend(
+                cc.delta_e(square_colors(color_palette, color_labels), reference[1])
+            )
+
+    print(f"{len(files)} covers, n_clusters={args.n_clusters}")
+    print(
+        f"{'mode':<16}{'s/cover':>10}{'speedup':>10}{'iters':>8}"
+        f"{'palette ΔE':>14}{'max':>8}{'squares ΔE':>14}{'max':>8}"
+    )
+    full_time: float = float(np.mean(timings["full"]))
+    for mode in modes:
+        mean_time: float = float(np.mean(timings[mode]))
+        print(
+            f"{mode:<16}{mean_time:>10.3f}{full_time / mean_time:>9.1f}x"
+            f"{np.mean(iterations[mode]):>8.1f}"
+            f"{np.mean(palette_drifts[mode]):>14.2f}{np.max(palette_drifts[mode]):>8.2f}"
+            f"{np.mean(square_drifts[mode]):>14.2f}{np.max(square_drifts[mode]):>8.2f}"
+        )
+    print(
+        "Warm start iterations: "
+        f"{np.mean(iterations['warm']) / np.mean(iterations['full']):.0%} of a cold fit, "
+        f"{np.mean(iterations['minibatch+warm']) / np.mean(iterations['minibatch']):.0%} with minibatch"
+    )
+
+
+if __name__ == "__main__":
+    main()
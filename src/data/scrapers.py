@@ -0,0 +1,210 @@
+import asyncio
+from typing import Protocol
+from urllib.parse import urlsplit
+
+import gather_magazines as gm
+import httpx
+from selectolax.parser import HTMLParser
+
+BASE_URL: str = "https://www.americastestkitchen.com/cooksillustrated/magazines"
+CARD_SELECTOR: str = "picture.StandardCardImage_cardImage__pH9Yg"
+LOAD_MORE_SELECTOR: str = "button.Button-module_fill__UsoCz"
+HEADERS: dict[str, str] = {
+    "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36"
+}
+
+BLOCKED_RESOURCE_TYPES: frozenset[str] = frozenset({"image", "media", "font"})
+BLOCKED_HOSTS: tuple[str, ...] = (
+    "google-analytics.com",
+    "googletagmanager.com",
+    "doubleclick.net",
+    "facebook.net",
+    "segment.com",
+    "segment.io",
+    "optimizely.com",
+    "hotjar.com",
+)
+
+
+class PaginationError(Exception):
+    """
+    PaginationError A listing page only repeated cards from earlier pages, so the site ignored the page parameter
+    """
+
+
+class ScraperBackend(Protocol):
+    async def scrape(self, known_names: set[str] | None = None) -> list[gm.Magazine]:
+        """
+        scrape Return the magazine cards of the listing, newest first
+
+        Args:
+            `known_names (set[str] | None)`: Names of issues already stored. Scraping stops at the first card that matches one
+
+        Returns:
+            `list[gm.Magazine]`: Every parsed card
+        """
+        ...
+
+
+class HttpxScraper:
+    """
+    HttpxScraper Fetch the paginated listing over plain HTTP and parse it with selectolax
+
+    Pages are requested `concurrency` at a time and parsed in order. Scraping stops at the first
+    empty page or at a stored issue. A page whose cards were all seen on earlier pages raises
+    `PaginationError` instead of ending the crawl, since it means every page is the first one.
+
+    Args:
+        `client (httpx.AsyncClient)`: httpx AsyncClient
+        `page_url (str)`: Listing url with a `{page}` placeholder
+        `concurrency (int)`: Number of pages requested at once
+        `max_pages (int)`: Upper bound on the number of pages
+    """
+
+    def __init__(
+        self,
+        client: httpx.AsyncClient,
+        page_url: str = BASE_URL + "?page={page}",
+        concurrency: int = 4,
+        max_pages: int = 100,
+    ) -> None:
+        self.client: httpx.AsyncClient = client
+        self.page_url: str = page_url
+        self.concurrency: int = concurrency
+        self.max_pages: int = max_pages
+
+    async def fetch_page(self, page: int) -> HTMLParser | None:
+        response: httpx.Response = await self.client.get(
+            self.page_url.format(page=page), headers=HEADERS, follow_redirects=True
+        )
+        if response.status_code == 404:
+            return None
+        response.raise_for_status()
+        return HTMLParser(response.text)
+
+    async def scrape(self, known_names: set[str] | None = None) -> list[gm.Magazine]:
+        known_names = known_names or set()
+        results: list[gm.Magazine] = []
+        seen_links: set[str] = set()
+
+        for first_page in range(1, self.max_pages + 1, self.concurrency):
+            last_page: int = min(first_page + self.concurrency, self.max_pages + 1)
+            pages: list[HTMLParser | None] = await asyncio.gather(
+                *(self.fetch_page(page) for page in range(first_page, last_page))
+            )
+            for html_page in pages:
+                items: list[gm.Magazine] = (
+                    list(gm.parse_item(html_page)) if html_page is not None else []
+                )
+                if not items:
+                    return results
+                if all(item.image_link in seen_links for item in items):
+                    raise PaginationError(
+                        f"{self.page_url} returned no new cards after {len(results)} cards"
+                    )
+                results.extend(items)
+                seen_links.update(item.image_link for item in items)
+                if any(item.name in known_names for item in items):
+                    print("Reached an issue that is already stored")
+                    return results
+        return results
+
+
+class PlaywrightScraper:
+    """
+    PlaywrightScraper Load the listing in headless Chromium and click "load more" until done
+
+    Cards are parsed while the page loads. Images, fonts and analytics requests are blocked.
+    Playwright is only imported when this backend is used.
+
+    Args:
+        `base_url (str)`: Listing url
+    """
+
+    def __init__(self, base_url: str = BASE_URL) -> None:
+        self.base_url: str = base_url
+
+    @staticmethod
+    async def block_requests(route) -> None:
+        # Only the card markup is needed, so skip images, fonts and analytics
+        request = route.request
+        host: str = urlsplit(request.url).netloc
+        if request.resource_type in BLOCKED_RESOURCE_TYPES or any(
+            host.endswith(blocked) for blocked in BLOCKED_HOSTS
+        ):
+            await route.abort()
+        else:
+            await route.continue_()
+
+    async def scrape(self, known_names: set[str] | None = None) -> list[gm.Magazine]:
+        from playwright.async_api import async_playwright
+
+        known_names = known_names or set()
+        results: list[gm.Magazine] = []
+        n_cards: int = 0
+
+        async with async_playwright() as p:
+            browser = await p.chromium.launch()
+            page = await browser.new_page()
+            await page.route("**/*", self.block_requests)
+
+            await page.goto(self.base_url)
+            await asyncio.sleep(1)
+            print("Visiting America's Test Kitchen")
+
+            load_more_button = page.locator(LOAD_MORE_SELECTOR)
+
+            while True:
+                # Only pull the cards added since the last pass out of the page
+                new_cards: list[str] = await page.eval_on_selector_all(
+                    CARD_SELECTOR,
+                    "(cards, start) => cards.slice(start).map(card => card.outerHTML)",
+                    n_cards,
+                )
+                n_cards += len(new_cards)
+                new_items: list[gm.Magazine] = list(
+                    gm.parse_item(HTMLParser("".join(new_cards)))
+                )
+                results.extend(new_items)
+
+                if any(item.name in known_names for item in new_items):
+                    print("Reached an issue that is already stored")
+                    break
+                if await load_more_button.count() == 0:
+                    break
+                await page.click(LOAD_MORE_SELECTOR)
+                await page.wait_for_load_state("networkidle")
+
+            await browser.close()
+
+        return results
+
+
+async def scrape_with_fallback(
+    client: httpx.AsyncClient, known_names: set[str] | None = None, backend: str = "httpx"
+) -> list[gm.Magazine]:
+    """
+    scrape_with_fallback Scrape with the chosen backend, falling back to Playwright when plain HTTP finds no cards or can't paginate
+
+    Args:
+        `client (httpx.AsyncClient)`: httpx AsyncClient for the httpx backend
+        `known_names (set[str] | None)`: Names of issues already stored
+        `backend (str)`: `httpx` or `playwright`
+
+    Returns:
+        `list[gm.Magazine]`: Every parsed card, newest first
+    """
+    scraper: ScraperBackend
+    if backend == "httpx":
+        scraper = HttpxScraper(client)
+        try:
+            results: list[gm.Magazine] = await scraper.scrape(known_names)
+        except (httpx.HTTPError, PaginationError) as exc:
+            # A partial crawl would look complete, so start over in the browser
+            print(f"Plain HTTP scraping failed: {exc!r}")
+            results = []
+        if results:
+            return results
+        print("Falling back to Playwright")
+    scraper = PlaywrightScraper()
+    return await scraper.scrape(known_names)
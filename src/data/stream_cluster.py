@@ -0,0 +1,99 @@
+import asyncio
+import hashlib
+import os
+from concurrent.futures import Executor
+from functools import partial
+from pathlib import Path
+
+import gather_magazines as gm
+import httpx
+import kmeans as km
+import metrics as mt
+import numpy as np
+import palette_cache as pc
+import polars as pl
+
+
+async def download_and_cluster(
+    df: pl.DataFrame,
+    client: httpx.AsyncClient,
+    executor: Executor,
+    kmeans_params: dict,
+    filepath: Path | None = None,
+    cache: pc.PaletteCache | None = None,
+    queue_size: int = 16,
+    n_consumers: int | None = None,
+    **download_kwargs,
+) -> tuple[gm.DownloadSummary, dict[str, tuple[str, np.ndarray, bool]]]:
+    """
+    download_and_cluster Cluster covers from memory while the remaining covers are still downloading
+
+    Every downloaded file is put on a bounded queue together with its bytes. Consumers decode
+    the bytes in `executor` without reading the file back from disk. When clustering falls
+    behind, the full queue holds back further downloads.
+
+    Args:
+        `df (pl.DataFrame)`: Polars DataFrame passed to `gather_magazines.download_images`
+        `client (httpx.AsyncClient)`: httpx AsyncClient
+        `executor (Executor)`: Pool that runs `kmeans.kmeans_rank`
+        `kmeans_params (dict)`: Keyword arguments for `kmeans.kmeans_img`
+        `filepath (Path | None)`: Destination folder of the downloads
+        `cache (pc.PaletteCache | None)`: Palette cache checked before clustering and filled afterwards
+        `queue_size (int)`: Maximum number of downloaded files waiting to be clustered
+        `n_consumers (int | None)`: Number of files clustered at once. Defaults to the number of CPUs
+        `**download_kwargs`: Keyword arguments for `gather_magazines.download_images`
+
+    Returns:
+        `tuple[gm.DownloadSummary, dict[str, tuple[str, np.ndarray, bool]]]`: download summary and, for every downloaded file, its content hash, ranked palette and whether it came from the cache
+    """
+    loop: asyncio.AbstractEventLoop = asyncio.get_running_loop()
+    queue: asyncio.Queue[tuple[Path, bytes] | None] = asyncio.Queue(maxsize=queue_size)
+    palettes: dict[str, tuple[str, np.ndarray, bool]] = {}
+
+    async def enqueue(filename: Path, data: bytes) -> None:
+        await queue.put((filename, data))
+
+    async def cluster(filename: Path, data: bytes) -> None:
+        content_hash: str = hashlib.sha256(data).hexdigest()
+        key: str | None = cache.key(content_hash, kmeans_params) if cache else None
+        ranked_palette: np.ndarray | None = cache.get(key) if cache else None
+        if ranked_palette is not None:
+            mt.count("fit.cache_hits")
+            palettes[str(filename)] = (content_hash, ranked_palette, True)
+            return
+        with mt.timer("fit.image"):
+            ranked_palette = await loop.run_in_executor(
+                executor, partial(km.kmeans_rank, data, **kmeans_params)
+            )
+        mt.count("fit.images")
+        mt.count("fit.pixels", int(ranked_palette["count"].sum()))
+        if cache:
+            cache.put(key, ranked_palette)
+        palettes[str(filename)] = (content_hash, ranked_palette, False)
+
+    async def consumer() -> None:
+        while (item := await queue.get()) is not None:
+            try:
+                await cluster(*item)
+            except Exception as exc:
+                # Keep consuming, otherwise the full queue would stall the downloads.
+                # The cover has no palette yet, so the cluster stage fits it from disk
+                print(f"Failed to cluster {item[0]}: {exc!r}")
+
+    consumers: list[asyncio.Task] = [
+        asyncio.create_task(consumer()) for _ in range(n_consumers or os.cpu_count() or 1)
+    ]
+    try:
+        summary: gm.DownloadSummary = await gm.download_images(
+            df, client, filepath=filepath, on_download=enqueue, **download_kwargs
+        )
+    except BaseException:
+        # Waiting for the consumers to drain the queue could block, so stop them
+        for task in consumers:
+            task.cancel()
+        await asyncio.gather(*consumers, return_exceptions=True)
+        raise
+    for _ in consumers:
+        await queue.put(None)
+    await asyncio.gather(*consumers)
+    return summary, palettes
@@ -0,0 +1,421 @@
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from collections.abc import Callable
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from pathlib import Path
+
+import color_squares as sq
+import gather_magazines as gm
+import gif_maker as gif_m
+import kmeans as km
+import metrics as mt
+import numpy as np
+import polars as pl
+from PIL import Image
+
+# One `<git revision>.json` per benchmarked revision
+RESULTS_FILEPATH: Path = Path.cwd() / "reports" / "benchmarks"
+
+# Portrait sizes with the aspect ratio of the scraped covers
+RESOLUTIONS: dict[str, tuple[int, int]] = {
+    "small": (300, 388),
+    "medium": (600, 776),
+    "large": (1200, 1552),
+}
+N_FRAMES: int = 12
+N_CLUSTERS: int = 10
+
+
+@dataclass
+class Case:
+    name: str
+    # Builds its inputs from the fixture folder and returns the call to time
+    setup: Callable[[Path], Callable[[], object]]
+    per_resolution: bool = True
+    use_sklearnex: bool | None = None
+    repeat: int | None = None
+
+
+def synthetic_cover(size: tuple[int, int], seed: int) -> Image.Image:
+    """
+    synthetic_cover Paint a cover-like image: a flat background, a few flat illustrated regions and film grain
+
+    Args:
+        `size (tuple[int, int])`: Width and height in pixels
+        `seed (int)`: Seed for the colors and the layout
+
+    Returns:
+        `Image.Image`: RGB image
+    """
+    rng: np.random.Generator = np.random.default_rng(seed)
+    width, height = size
+    cover: np.ndarray = np.empty((height, width, 3), dtype=np.float32)
+    cover[:] = rng.integers(0, 256, 3)
+    for _ in range(N_CLUSTERS):
+        left, right = np.sort(rng.integers(0, width, 2))
+        top, bottom = np.sort(rng.integers(0, height, 2))
+        cover[top : bottom + 1, left : right + 1] = rng.integers(0, 256, 3)
+    cover += rng.normal(0, 6, cover.shape)
+    return Image.fromarray(np.clip(cover, 0, 255).astype(np.uint8))
+
+
+def make_fixtures(folder: Path, resolutions: list[str]) -> None:
+    """
+    make_fixtures Write `N_FRAMES` synthetic covers and their squares for every resolution
+
+    Args:
+        `folder (Path)`: Fixture folder, with one subfolder per resolution
+        `resolutions (list[str])`: Keys of `RESOLUTIONS`
+    """
+    rng: np.random.Generator = np.random.default_rng(0)
+    for resolution in resolutions:
+        Path.mkdir(folder / resolution, parents=True, exist_ok=True)
+        for i in range(N_FRAMES):
+            synthetic_cover(RESOLUTIONS[resolution], seed=i).save(
+                folder / resolution / f"{i:02}.jpg", quality=90
+            )
+            sq.save_square(
+                rng.integers(0, 256, (4, 3)), folder / resolution / f"{i:02}.webp"
+            )
+
+
+def frame_paths(folder: Path) -> list[list[Path]]:
+    return [[cover, cover.with_suffix(".webp")] for cover in sorted(folder.glob("*.jpg"))]
+
+
+def setup_clean_df_name(folder: Path) -> Callable[[], object]:
+    months: list[str] = [
+        "January", "February", "March", "April", "May", "June",
+        "July", "August", "September", "October", "November", "December",
+    ]  # fmt: skip
+    names: list[str] = [
+        f"{months[i % 12]}/{months[(i + 1) % 12]} {1993 + i % 32}" for i in range(10_000)
+    ]
+    df: pl.DataFrame = pl.DataFrame(
+        {
+            "name": names,
+            "image_link": [
+                f"https://res.cloudinary.com/upload/t_cover/v{i}/{i}.jpg"
+                for i in range(len(names))
+            ],
+        }
+    )
+    return lambda: gm.clean_df_name(df)
+
+
+def setup_kmeans_img(folder: Path) -> Callable[[], object]:
+    cover: Path = folder / "00.jpg"
+    return lambda: km.kmeans_img(cover, n_clusters=N_CLUSTERS, random_state=0)
+
+
+def setup_get_color_labels(folder: Path) -> Callable[[], object]:
+    _, color_labels = km.kmeans_img(folder / "00.jpg", n_clusters=N_CLUSTERS, random_state=0)
+    return lambda: km.get_color_labels(color_labels)
+
+
+def setup_save_square(folder: Path) -> Callable[[], object]:
+    colors: np.ndarray = np.random.default_rng(0).uniform(0, 255, (4, 3))
+    output_file: Path = folder / "benchmark-square.webp"
+    return lambda: sq.save_square(colors, output_file)
+
+
+def setup_combine_images(folder: Path) -> Callable[[], object]:
+    image_paths: list[Path] = frame_paths(folder)[0]
+    return lambda: gif_m.combine_images(image_paths)
+
+
+def setup_make_gif(folder: Path) -> Callable[[], object]:
+    paths: list[list[Path]] = frame_paths(folder)
+    return lambda: gif_m.make_gif(
+        None, folder / "benchmark.gif", frame_paths=paths, max_workers=1
+    )
+
+
+def setup_compress_gif(folder: Path) -> Callable[[], object]:
+    gif_m.make_gif(
+        None, folder / "benchmark.gif", frame_paths=frame_paths(folder), max_workers=1
+    )
+    return lambda: gif_m.compress_gif(
+        folder / "benchmark.gif", folder / "benchmark-compressed.gif"
+    )
+
+
+CASES: dict[str, Case] = {
+    case.name: case
+    for case in [
+        Case("clean_df_name", setup_clean_df_name, per_resolution=False),
+        Case("kmeans_img[sklearnex]", setup_kmeans_img, use_sklearnex=True),
+        Case("kmeans_img[sklearn]", setup_kmeans_img, use_sklearnex=False),
+        Case("get_color_labels", setup_get_color_labels),
+        Case("save_square", setup_save_square, per_resolution=False),
+        Case("combine_images", setup_combine_images),
+        Case("make_gif", setup_make_gif, repeat=1),
+        Case("compress_gif", setup_compress_gif, repeat=1),
+    ]
+}
+
+
+def peak_rss_mb(children: bool = False) -> float | None:
+    peak: int | None = mt.peak_rss(children)
+    return None if peak is None else peak / (1 << 20)
+
+
+def run_case(name: str, folder: Path, repeat: int) -> dict:
+    """
+    run_case Time one case in the current process. Called in a fresh subprocess by `benchmark`
+
+    Args:
+        `name (str)`: Key of `CASES`
+        `folder (Path)`: Fixture folder of the resolution
+        `repeat (int)`: Number of timed calls, after one untimed warm-up call
+
+    Returns:
+        `dict`: Timings in seconds and resident set sizes in MB. The baseline is the peak before the first call
+    """
+    call: Callable[[], object] = CASES[name].setup(folder)
+    baseline_rss: float | None = peak_rss_mb()
+    call()
+
+    times: list[float] = []
+    for _ in range(repeat):
+        start_time: float = time.perf_counter()
+        call()
+        times.append(time.perf_counter() - start_time)
+
+    return {
+        "repeat": repeat,
+        "min_s": min(times),
+        "median_s": statistics.median(times),
+        "mean_s": statistics.fmean(times),
+        "baseline_rss_mb": baseline_rss,
+        "peak_rss_mb": peak_rss_mb(),
+        "children_peak_rss_mb": peak_rss_mb(children=True),
+    }
+
+
+def benchmark(
+    cases: list[str], resolutions: list[str], repeat: int, folder: Path
+) -> list[dict]:
+    """
+    benchmark Run every case in its own subprocess so imports, sklearnex patching and peak RSS don't leak between cases
+
+    Args:
+        `cases (list[str])`: Keys of `CASES`
+        `resolutions (list[str])`: Keys of `RESOLUTIONS`
+        `repeat (int)`: Number of timed calls per case, unless the case sets its own
+        `folder (Path)`: Fixture folder made by `make_fixtures`
+
+    Returns:
+        `list[dict]`: One result per case and resolution. Failed cases have an `error` instead of timings
+    """
+    results: list[dict] = []
+    for name in cases:
+        case: Case = CASES[name]
+        env: dict[str, str] = dict(os.environ)
+        if case.use_sklearnex is not None:
+            env["USE_SKLEARNEX"] = "1" if case.use_sklearnex else "0"
+        for resolution in resolutions if case.per_resolution else [resolutions[0]]:
+            result: dict = {
+                "case": name,
+                "resolution": resolution if case.per_resolution else None,
+            }
+            print(f"Running {name} [{result['resolution'] or '-'}]...")
+            process = subprocess.run(
+                [
+                    sys.executable,
+                    "-m",
+                    "src.run_benchmarks",
+                    "--run-case",
+                    name,
+                    "--fixtures",
+                    str(folder / resolution),
+                    "--repeat",
+                    str(case.repeat or repeat),
+                ],
+                env=env,
+                capture_output=True,
+                text=True,
+            )
+            if process.returncode == 0:
+                result |= json.loads(process.stdout.splitlines()[-1])
+            else:
+                result["error"] = (process.stderr.strip().splitlines() or ["failed"])[-1]
+            results.append(result)
+    return results
+
+
+def load_runs(results_folder: Path) -> dict[str, dict]:
+    runs: dict[str, dict] = {}
+    for results_file in results_folder.glob("*.json"):
+        with open(results_file) as f:
+            run = json.load(f)
+        if isinstance(run, dict) and "results" in run:
+            runs[results_file.stem] = run
+    return runs
+
+
+def save_run(results_folder: Path, run: dict) -> Path:
+    Path.mkdir(results_folder, parents=True, exist_ok=True)
+    results_file: Path = results_folder / f"{run['revision']}.json"
+    with open(results_file, "w") as f:
+        json.dump(run, f, indent=2)
+    return results_file
+
+
+def git_revision() -> str:
+    """
+    git_revision Return the full hash of HEAD, with a `-dirty` suffix when tracked files have uncommitted changes
+
+    Returns:
+        `str`: Revision the results are keyed by, or `unknown` outside a git checkout
+    """
+
+    def git(*args: str) -> str:
+        return subprocess.run(
+            ["git", *args],
+            capture_output=True,
+            text=True,
+            check=True,
+            cwd=Path(__file__).resolve().parent,
+        ).stdout.strip()
+
+    try:
+        revision: str = git("rev-parse", "HEAD")
+        if git("status", "--porcelain", "--untracked-files=no"):
+            revision += "-dirty"
+        return revision
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def find_baseline(runs: dict[str, dict], revision: str, baseline: str | None) -> dict | None:
+    """
+    find_baseline Pick the run to compare with
+
+    Args:
+        `runs (dict[str, dict])`: Recorded runs keyed by revision
+        `revision (str)`: Revision of this run
+        `baseline (str | None)`: Revision or revision prefix to compare with. Defaults to the latest run of another revision
+
+    Returns:
+        `dict | None`: The baseline run, if one was recorded
+    """
+    if baseline is not None:
+        matches: list[str] = [key for key in runs if key.startswith(baseline)]
+        if len(matches) != 1:
+            raise ValueError(f"{baseline!r} matches {len(matches)} recorded revisions")
+        return runs[matches[0]]
+    others: list[dict] = [run for key, run in runs.items() if key != revision]
+    return max(others, key=lambda run: run["timestamp"], default=None)
+
+
+def format_mb(value: float | None) -> str:
+    return "-" if value is None else f"{value:.0f}"
+
+
+def print_result(result: dict, previous: dict | None = None) -> None:
+    label: str = f"{result['case']} [{result['resolution'] or '-'}]"
+    if "error" in result:
+        print(f"{label:<34}failed: {result['error']}")
+        return
+    change: str = ""
+    if previous and "median_s" in previous:
+        change = f"{result['median_s'] / previous['median_s']:>8.2f}x"
+    print(
+        f"{label:<34}{result['median_s']:>10.4f} s"
+        f"{format_mb(result['peak_rss_mb']):>8} MB peak{change}"
+    )
+
+
+def print_summary(results: list[dict], baseline: dict | None) -> None:
+    """
+    print_summary Compare each result with the baseline run and sklearnex with plain scikit-learn
+
+    Args:
+        `results (list[dict])`: Results of this run
+        `baseline (dict | None)`: Recorded run to compare with
+    """
+    previous: dict[tuple, dict] = {
+        (result["case"], result["resolution"]): result
+        for result in (baseline["results"] if baseline else [])
+    }
+
+    print(
+        "\nMedian time and peak RSS"
+        + (f", compared with {baseline['revision'][:12]}" if baseline else "")
+    )
+    for result in results:
+        print_result(result, previous.get((result["case"], result["resolution"])))
+
+    medians: dict[tuple, float] = {
+        (result["case"], result["resolution"]): result["median_s"]
+        for result in results
+        if "median_s" in result
+    }
+    for resolution in RESOLUTIONS:
+        sklearnex = medians.get(("kmeans_img[sklearnex]", resolution))
+        sklearn = medians.get(("kmeans_img[sklearn]", resolution))
+        if sklearnex and sklearn:
+            print(f"sklearnex speedup [{resolution}]: {sklearn / sklearnex:.2f}x")
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Time every pipeline stage on synthetic covers and record the results as JSON keyed by git revision"
+    )
+    parser.add_argument("--cases", nargs="*", default=list(CASES), choices=list(CASES))
+    parser.add_argument(
+        "--resolutions", nargs="*", default=list(RESOLUTIONS), choices=list(RESOLUTIONS)
+    )
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--results", type=Path, default=RESULTS_FILEPATH)
+    parser.add_argument(
+        "--baseline",
+        metavar="REVISION",
+        help="Revision to compare with. Defaults to the latest run of another revision",
+    )
+    parser.add_argument("--no-save", action="store_true", help="Don't record this run")
+    parser.add_argument("--run-case", choices=list(CASES), help=argparse.SUPPRESS)
+    parser.add_argument("--fixtures", type=Path, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run_case:
+        print(json.dumps(run_case(args.run_case, args.fixtures, args.repeat)))
+        return
+
+    revision: str = git_revision()
+    baseline: dict | None = find_baseline(load_runs(args.results), revision, args.baseline)
+    with tempfile.TemporaryDirectory() as folder:
+        print("Generating synthetic covers...")
+        make_fixtures(Path(folder), args.resolutions)
+        results: list[dict] = benchmark(
+            args.cases, args.resolutions, args.repeat, Path(folder)
+        )
+
+    print_summary(results, baseline)
+    if not args.no_save:
+        # A rerun of the same revision replaces its results
+        results_file: Path = save_run(
+            args.results,
+            {
+                "revision": revision,
+                "timestamp": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+                "python": platform.python_version(),
+                "platform": platform.platform(),
+                "cpu_count": os.cpu_count(),
+                "results": results,
+            },
+        )
+        print(f"Results saved to {results_file}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,410 @@
+import argparse
+import asyncio
+import hashlib
+import json
+from collections.abc import Awaitable, Callable
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, field
+from graphlib import TopologicalSorter
+from pathlib import Path
+
+import color_squares as sq
+import cover_index as ci
+import gather_magazines as gm
+import gif_maker as gif_m
+import httpx
+import kmeans as km
+import metrics as mt
+import numpy as np
+import palette_cache as pc
+import palette_store as ps
+import pixel_archive as pa
+import polars as pl
+import run_gather_magazines as rgm
+import stream_cluster as sc
+
+STATE_FILEPATH: Path = Path.cwd() / "data" / "interim" / "pipeline-state.json"
+FIGURES_FILEPATH: Path = Path.cwd() / "reports" / "figures"
+METRICS_FILEPATH: Path = Path.cwd() / "reports" / "metrics" / "pipeline-metrics.jsonl"
+
+
+@dataclass
+class PipelineContext:
+    kmeans_params: dict
+    backend: str = "httpx"
+    max_workers: int | None = None
+    executor: ProcessPoolExecutor | None = None
+    # Palettes fitted from memory for covers downloaded earlier in this run
+    streamed_palettes: dict[str, tuple[str, np.ndarray]] = field(default_factory=dict)
+    stream_clustering: bool = False
+    # Cluster and animate from the memory-mapped pixel archive instead of the JPEGs
+    use_archive: bool = False
+
+    @property
+    def warm_start(self) -> bool:
+        # Start each cover's fit from the previous cover's centroids, in chronological order
+        return self.kmeans_params.get("warm_start", False)
+
+
+@dataclass
+class Stage:
+    name: str
+    # Returns False when work is left undone, so the stage runs again next time
+    run: Callable[[PipelineContext], Awaitable[bool | None]]
+    depends_on: tuple[str, ...] = ()
+    inputs: Callable[[], list[Path]] = lambda: []
+    outputs: Callable[[], list[Path]] = lambda: []
+    params: Callable[[PipelineContext], dict] = lambda ctx: {}
+    always_run: bool = False
+
+
+def path_fingerprint(path: Path) -> list:
+    """
+    path_fingerprint Describe a file, or every file under a folder, by name, size and modification time
+
+    Args:
+        `path (Path)`: File or folder
+
+    Returns:
+        `list`: JSON-serializable description. Empty when the path does not exist
+    """
+    if path.is_file():
+        stat = path.stat()
+        return [[str(path), stat.st_size, stat.st_mtime_ns]]
+    if path.is_dir():
+        return [
+            entry
+            for child in sorted(path.rglob("*"))
+            if child.is_file()
+            for entry in path_fingerprint(child)
+        ]
+    return []
+
+
+def stage_fingerprint(stage: Stage, ctx: PipelineContext) -> str:
+    payload: list = [
+        stage.name,
+        stage.params(ctx),
+        [path_fingerprint(path) for path in stage.inputs()],
+    ]
+    return hashlib.sha256(json.dumps(payload, sort_keys=True).encode()).hexdigest()
+
+
+def load_state() -> dict[str, str]:
+    if STATE_FILEPATH.exists():
+        with open(STATE_FILEPATH) as f:
+            return json.load(f)
+    return {}
+
+
+def save_state(state: dict[str, str]) -> None:
+    Path.mkdir(STATE_FILEPATH.parent, parents=True, exist_ok=True)
+    with open(STATE_FILEPATH, "w") as f:
+        json.dump(state, f, indent=2)
+
+
+async def scrape(ctx: PipelineContext) -> None:
+    async with httpx.AsyncClient(http2=True) as client:
+        await rgm.update_metadata(client, backend=ctx.backend)
+
+
+async def download(ctx: PipelineContext) -> bool:
+    Path.mkdir(ci.OG_IMG_FILEPATH, parents=True, exist_ok=True)
+    max_concurrency: int = 8
+    download_kwargs: dict = {
+        "filepath": ci.OG_IMG_FILEPATH,
+        "max_concurrency": max_concurrency,
+        "requests_per_second": 20,
+    }
+    async with httpx.AsyncClient(
+        http2=True, limits=httpx.Limits(max_connections=max_concurrency)
+    ) as client:
+        if not ctx.stream_clustering:
+            summary: gm.DownloadSummary = await gm.download_images(
+                ci.read_magazines(), client, **download_kwargs
+            )
+            return summary.failed == 0
+        summary, palettes = await sc.download_and_cluster(
+            ci.read_magazines(),
+            client,
+            ctx.executor,
+            ctx.kmeans_params,
+            cache=pc.PaletteCache(),
+            n_consumers=ctx.max_workers,
+            **download_kwargs,
+        )
+    ctx.streamed_palettes.update(
+        (file, (content_hash, ranked_palette))
+        for file, (content_hash, ranked_palette, _) in palettes.items()
+    )
+    return summary.failed == 0
+
+
+async def archive(ctx: PipelineContext) -> None:
+    pa.build_archive(
+        ci.cover_paths(ci.build_cover_index(palette_filepath=None)),
+        max_workers=ctx.max_workers,
+    )
+
+
+async def cluster(ctx: PipelineContext) -> None:
+    cover_index: pl.DataFrame = ci.build_cover_index(palette_filepath=None)
+    covers: dict[str, dict] = ci.cover_lookup(cover_index)
+    cache: pc.PaletteCache = pc.PaletteCache()
+
+    stored: set[tuple[str, str]] = ps.stored_keys(ci.PALETTE_FILEPATH, ctx.kmeans_params)
+
+    def store_palette(
+        palette_store: ps.PaletteStore,
+        file: str,
+        content_hash: str,
+        ranked_palette: np.ndarray,
+    ) -> None:
+        cover: dict = covers[Path(file).stem]
+        if (cover["filename"], content_hash) in stored:
+            return
+        palette_store.append(
+            ps.palette_record(
+                filename=cover["filename"],
+                ranked_palette=ranked_palette,
+                kmeans_params=ctx.kmeans_params,
+                content_hash=content_hash,
+                year=cover["year"],
+                month=cover["start_month_num"],
+            )
+        )
+
+    cover_files: list[str] = ci.cover_paths(cover_index)
+    with ps.PaletteStore(ci.PALETTE_FILEPATH) as palette_store:
+        for file, (content_hash, ranked_palette) in ctx.streamed_palettes.items():
+            store_palette(palette_store, file, content_hash, ranked_palette)
+
+        remaining: list[str] = [
+            file for file in cover_files if file not in ctx.streamed_palettes
+        ]
+        sources: list = pa.archive_sources(remaining) if ctx.use_archive else remaining
+        source_files: dict = dict(zip(sources, remaining))
+        for source, content_hash, ranked_palette, _ in pc.cached_palettes(
+            sources,
+            cache,
+            max_workers=ctx.max_workers,
+            **ctx.kmeans_params,
+        ):
+            store_palette(palette_store, source_files[source], content_hash, ranked_palette)
+
+
+async def render(ctx: PipelineContext) -> None:
+    Path.mkdir(ci.SQUARES_FILEPATH, parents=True, exist_ok=True)
+    cover_index: pl.DataFrame = ci.build_cover_index()
+    if "centroids" not in cover_index.columns:
+        return
+    for filename, centroids in (
+        cover_index.drop_nulls("centroids").select("filename", "centroids").iter_rows()
+    ):
+        ranked_colors: np.ndarray = np.asarray(centroids, dtype=np.float32)
+        if len(ranked_colors) <= max(km.SQUARE_COLOR_INDICES):
+            print(f"Skipping {filename}: not enough clusters for a square")
+            continue
+        sq.save_square(
+            ranked_colors[list(km.SQUARE_COLOR_INDICES)],
+            ci.SQUARES_FILEPATH / f"{filename}-square.webp",
+        )
+
+
+async def animate(ctx: PipelineContext) -> None:
+    Path.mkdir(FIGURES_FILEPATH, parents=True, exist_ok=True)
+    frame_paths: list = gif_m.get_frame_paths()
+    if ctx.use_archive:
+        frame_paths = pa.archive_frame_paths(frame_paths)
+    timings: gif_m.StageTimings = gif_m.make_gif(
+        frame_folder=None,
+        output_file=FIGURES_FILEPATH / "magazine-covers.gif",
+        compressed_output_file=FIGURES_FILEPATH / "compressed-magazine-covers.gif",
+        max_workers=ctx.max_workers,
+        frame_paths=frame_paths,
+    )
+    print(timings)
+
+
+STAGES: dict[str, Stage] = {
+    stage.name: stage
+    for stage in [
+        Stage("scrape", scrape, outputs=lambda: [ci.MAGAZINE_FILEPATH], always_run=True),
+        Stage(
+            "download",
+            download,
+            depends_on=("scrape",),
+            inputs=lambda: [ci.MAGAZINE_FILEPATH],
+            outputs=lambda: [ci.OG_IMG_FILEPATH],
+        ),
+        Stage(
+            "archive",
+            archive,
+            depends_on=("download",),
+            inputs=lambda: [ci.MAGAZINE_FILEPATH, ci.OG_IMG_FILEPATH],
+            outputs=lambda: [pa.ARCHIVE_FILEPATH],
+            params=lambda ctx: {"size": pa.WORKING_SIZE},
+        ),
+        Stage(
+            "cluster",
+            cluster,
+            depends_on=("archive",),
+            inputs=lambda: [ci.MAGAZINE_FILEPATH, ci.OG_IMG_FILEPATH],
+            outputs=lambda: [ci.PALETTE_FILEPATH],
+            params=lambda ctx: {**ctx.kmeans_params, "archive": ctx.use_archive},
+        ),
+        Stage(
+            "render",
+            render,
+            depends_on=("cluster",),
+            inputs=lambda: [ci.PALETTE_FILEPATH],
+            outputs=lambda: [ci.SQUARES_FILEPATH],
+            params=lambda ctx: {"layout": sq.SQUARE_LAYOUT},
+        ),
+        Stage(
+            "animate",
+            animate,
+            depends_on=("render",),
+            inputs=lambda: [ci.MAGAZINE_FILEPATH, ci.OG_IMG_FILEPATH, ci.SQUARES_FILEPATH],
+            params=lambda ctx: {"archive": True} if ctx.use_archive else {},
+            outputs=lambda: [
+                FIGURES_FILEPATH / "magazine-covers.gif",
+                FIGURES_FILEPATH / "compressed-magazine-covers.gif",
+            ],
+        ),
+    ]
+}
+
+
+def is_stale(stage: Stage, ctx: PipelineContext, state: dict[str, str]) -> bool:
+    return (
+        stage.always_run
+        or state.get(stage.name) != stage_fingerprint(stage, ctx)
+        or not all(path.exists() for path in stage.outputs())
+    )
+
+
+async def run_pipeline(
+    ctx: PipelineContext, skip: set[str] | None = None, force: set[str] | None = None
+) -> None:
+    """
+    run_pipeline Run every stale stage in dependency order
+
+    A stage is stale when the fingerprint of its inputs and parameters differs from the last
+    successful run or one of its outputs is missing. A download with failed files is not a
+    successful run, so those files are retried next time. When both download and cluster will run,
+    covers are clustered from memory in a process pool as soon as their download finishes.
+
+    Args:
+        `ctx (PipelineContext)`: Settings shared by the stages
+        `skip (set[str] | None)`: Stages never to run
+        `force (set[str] | None)`: Stages to run even when up to date
+    """
+    skip = skip or set()
+    force = force or set()
+    state: dict[str, str] = load_state()
+    order: list[str] = list(
+        TopologicalSorter(
+            {name: stage.depends_on for name, stage in STAGES.items()}
+        ).static_order()
+    )
+
+    if not ctx.use_archive:
+        skip = skip | {"archive"}
+    # Downloads finish in any order, so warm-started fits wait for the cluster stage.
+    # Archived covers are clustered at the working size, so they wait for the archive
+    ctx.stream_clustering = (
+        "download" not in skip
+        and "cluster" not in skip
+        and not ctx.warm_start
+        and not ctx.use_archive
+    )
+    with ProcessPoolExecutor(
+        max_workers=ctx.max_workers, initializer=km.init_worker
+    ) as executor:
+        ctx.executor = executor
+        for name in order:
+            stage: Stage = STAGES[name]
+            if name in skip:
+                print(f"[{name}] skipped")
+                continue
+            if name not in force and not is_stale(stage, ctx, state):
+                print(f"[{name}] up to date")
+                continue
+
+            print(f"[{name}] running")
+            with mt.stage(name) as timing:
+                complete: bool | None = await stage.run(ctx)
+            peak_rss: str = (
+                f", peak RSS {timing.peak_rss / 2**20:.0f} MB" if timing.peak_rss else ""
+            )
+            if complete is False:
+                # Leave the old fingerprint so the stage is stale on the next run
+                print(f"[{name}] incomplete after {timing.elapsed:.2f} seconds{peak_rss}")
+                continue
+            state[name] = stage_fingerprint(stage, ctx)
+            save_state(state)
+            print(f"[{name}] finished in {timing.elapsed:.2f} seconds{peak_rss}")
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Scrape, download, cluster, render and animate the magazine covers, running only what changed"
+    )
+    parser.add_argument("--skip", nargs="*", default=[], choices=list(STAGES))
+    parser.add_argument("--force", nargs="*", default=[], choices=list(STAGES))
+    parser.add_argument("--backend", choices=["httpx", "playwright"], default="httpx")
+    parser.add_argument("--n-clusters", type=int, default=10)
+    parser.add_argument("--color-space", choices=list(km.COLOR_SPACES), default="rgb")
+    parser.add_argument("--max-workers", type=int, default=None)
+    parser.add_argument(
+        "--warm-start",
+        action="store_true",
+        help="Start each cover's fit from the centroids of the cover before it",
+    )
+    parser.add_argument(
+        "--archive",
+        action="store_true",
+        help="Decode the covers once into a memory-mapped pixel archive, then cluster and animate from it",
+    )
+    parser.add_argument(
+        "--metrics-file",
+        type=Path,
+        default=METRICS_FILEPATH,
+        help="Append the timers and counters as JSON lines, or write Prometheus text when the suffix is .prom",
+    )
+    parser.add_argument(
+        "--profile",
+        type=Path,
+        metavar="FOLDER",
+        help="Write a cProfile .prof file per stage to this folder",
+    )
+    args = parser.parse_args()
+
+    if args.profile:
+        mt.METRICS.profile_dir = args.profile
+
+    ctx: PipelineContext = PipelineContext(
+        kmeans_params=pc.normalize_params(
+            {
+                "n_clusters": args.n_clusters,
+                "color_space": args.color_space,
+                "warm_start": args.warm_start,
+            }
+        ),
+        backend=args.backend,
+        max_workers=args.max_workers,
+        use_archive=args.archive,
+    )
+    try:
+        asyncio.run(run_pipeline(ctx, skip=set(args.skip), force=set(args.force)))
+    finally:
+        if args.metrics_file.suffix == ".prom":
+            mt.METRICS.write_prometheus(args.metrics_file)
+        else:
+            mt.METRICS.write_json_lines(args.metrics_file)
+        print(f"Metrics written to {args.metrics_file}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,54 +1,125 @@
-import glob
+import os
 import shutil
+import time
+from collections import deque
+from collections.abc import Iterable, Iterator
+from concurrent.futures import Future, ProcessPoolExecutor
+from contextlib import ExitStack
+from dataclasses import dataclass
 from pathlib import Path
 from re import split
+from types import TracebackType
+from typing import BinaryIO
 
-import polars as pl
-from PIL import Image, ImageSequence
+import cover_index as ci
+import image_io as imio
+import metrics as mt
+from PIL import GifImagePlugin, Image, ImageSequence
+
+# Every cover and square is scaled to this size before they are placed side by side
+FRAME_IMAGE_SIZE: tuple[int, int] = (1000, 1000)
 
 
 def get_filtered_images() -> list[str]:
-    og_img_filepath: Path = Path.cwd() / "data" / "raw" / "cooks-illustrated"
-    files: list[tuple[str, str]] = [
-        (str(path), path.stem) for path in og_img_filepath.rglob("*") if path.is_file()
-    ]
-    magazine_filepath: Path = Path.cwd() / "data" / "raw" / "magazine_covers.csv"
-    magazine_covers: pl.DataFrame = (
-        pl.read_csv(magazine_filepath)
-        .filter(pl.col.is_blank_cover != 1)
-        .select(pl.exclude("is_blank_cover"))
+    return ci.cover_paths(ci.build_cover_index(palette_filepath=None))
+
+
+def get_frame_paths(
+    og_img_filepath: Path = ci.OG_IMG_FILEPATH,
+    squares_filepath: Path = ci.SQUARES_FILEPATH,
+    magazine_filepath: Path = ci.MAGAZINE_FILEPATH,
+) -> list[tuple[Path, Path]]:
+    """
+    get_frame_paths Pair every non-blank cover with its KMeans square, straight from the magazine metadata
+
+    Args:
+        `og_img_filepath (Path)`: Folder of raw covers
+        `squares_filepath (Path)`: Folder of KMeans squares
+        `magazine_filepath (Path)`: Magazine metadata Parquet file
+
+    Returns:
+        `list[tuple[Path, Path]]`: (cover, square) paths in chronological order, skipping issues missing either file
+    """
+    return ci.frame_paths(
+        ci.build_cover_index(
+            magazine_filepath=magazine_filepath,
+            og_img_filepath=og_img_filepath,
+            squares_filepath=squares_filepath,
+            palette_filepath=None,
+        )
     )
 
-    filtered_magazines: list[str] = magazine_covers.get_column("filename").to_list()
-    filtered_files: list[str] = [
-        file[0] for file in files if file[1] in filtered_magazines
-    ]
 
-    return filtered_files
+def _place_file(file: Path, destination: Path, mode: str) -> None:
+    if mode == "copy":
+        shutil.copy(file, destination)
+        return
+    destination.unlink(missing_ok=True)
+    if mode == "hardlink":
+        os.link(file, destination)
+    elif mode == "symlink":
+        destination.symlink_to(Path(file).resolve())
+    else:
+        raise ValueError(f"mode must be copy, hardlink or symlink, got {mode!r}")
+
 
+def transfer_files(
+    source: list[str] | Path, destination_path: str | Path, mode: str = "copy"
+):
+    """
+    transfer_files Place files in a folder by copying, hardlinking or symlinking them
 
-def transfer_files(source: list[str] | Path, destination_path: str | Path):
-    source = source
-    destination_path = destination_path
+    Args:
+        `source (list[str] | Path)`: Files to place, or a folder of KMeans squares whose `-square` suffix is dropped
+        `destination_path (str | Path)`: Destination folder
+        `mode (str)`: One of `copy`, `hardlink` or `symlink`
+    """
+    destination_path = Path(destination_path)
 
     if isinstance(source, list):
         for file in source:
-            shutil.copy(file, f"{destination_path}/{Path(file).name}")
+            _place_file(Path(file), destination_path / Path(file).name, mode)
     else:
         for file in source.iterdir():
             if file.is_file():
-                shutil.copy(
+                _place_file(
                     file,
-                    f"{destination_path}/{split(r"-square", file.stem)[0]}{file.suffix}",
+                    destination_path / f"{split(r'-square', file.stem)[0]}{file.suffix}",
+                    mode,
                 )
 
 
+def export_frame_folder(
+    frame_paths: Iterable[tuple[Path, Path]], destination_path: Path, mode: str = "hardlink"
+):
+    """
+    export_frame_folder Place every cover and square in one folder, with the `-square` suffix dropped
+
+    Args:
+        `frame_paths (Iterable[tuple[Path, Path]])`: (cover, square) paths from `get_frame_paths`
+        `destination_path (Path)`: Destination folder
+        `mode (str)`: One of `copy`, `hardlink` or `symlink`
+    """
+    Path.mkdir(destination_path, parents=True, exist_ok=True)
+    for cover, square in frame_paths:
+        _place_file(cover, destination_path / cover.name, mode)
+        _place_file(
+            square,
+            destination_path / f"{split(r'-square', square.stem)[0]}{square.suffix}",
+            mode,
+        )
+
+
 def resize_image(image, size):
     return image.resize(size, Image.LANCZOS)
 
 
 def combine_images(image_paths):
-    images = [resize_image(Image.open(image), (1000, 1000)) for image in image_paths]
+    images = [imio.load_image(image, FRAME_IMAGE_SIZE) for image in image_paths]
+    return compose_images(images)
+
+
+def compose_images(images):
     widths, heights = zip(*(i.size for i in images))
 
     total_width = sum(widths)
@@ -64,44 +135,256 @@ def combine_images(image_paths):
     return new_im
 
 
-def make_gif(
-    frame_folder: str | Path, output_file: Path, duration: int = 1000, loop: int = 0
-):
-    jpg_paths = glob.glob(f"{frame_folder}/*.jpg")
-    webp_paths = glob.glob(f"{frame_folder}/*.webp")
-
-    frames = []
-    for i in range(0, min(len(jpg_paths), len(webp_paths)) - 1, 2):
-        frames.append(combine_images([jpg_paths[i], webp_paths[i]]))
-
-    frame_one: Image.Image = frames[0]
-    frame_one.save(
-        output_file,
-        format="GIF",
-        append_images=frames[1:],
-        save_all=True,
-        duration=duration,
-        loop=loop,
-    )
+def quantize_frame(frame: Image.Image, scale: float | None = None) -> Image.Image:
+    """
+    quantize_frame Optionally resize a frame and reduce it to a 256-color palette for GIF encoding
+
+    Args:
+        `frame (Image.Image)`: Frame in any mode
+        `scale (float | None)`: Resize factor applied before quantizing
+
+    Returns:
+        `Image.Image`: Palette ("P" mode) image
+    """
+    if scale:
+        frame = resize_image(
+            frame, (int(frame.width * scale), int(frame.height * scale))
+        )
+    return frame.convert("RGB").convert("P", palette=Image.Palette.ADAPTIVE)
 
 
-def compress_gif(image: str | Path, output_file: Path):
-    im: Image.Image = Image.open(image)
+@dataclass
+class StageTimings:
+    frames: int = 0
+    decode_resize: float = 0.0
+    compose: float = 0.0
+    quantize: float = 0.0
+    encode: float = 0.0
+    wall: float = 0.0
 
-    output_width: int = int(im.width * 0.7)
-    output_height: int = int(im.height * 0.7)
+    def add(self, other: "StageTimings") -> None:
+        self.frames += other.frames
+        self.decode_resize += other.decode_resize
+        self.compose += other.compose
+        self.quantize += other.quantize
+        self.encode += other.encode
 
-    frames = ImageSequence.Iterator(im)
+    def __str__(self) -> str:
+        return (
+            f"{self.frames} frames in {self.wall:.2f} s wall time | CPU time per stage: "
+            f"decode+resize {self.decode_resize:.2f} s, compose {self.compose:.2f} s, "
+            f"quantize {self.quantize:.2f} s, encode {self.encode:.2f} s"
+        )
 
-    resized_frames = [
-        frame.copy().resize((output_width, output_height), Image.LANCZOS)
-        for frame in frames
+
+def build_frame(
+    image_paths: Iterable[str | Path], scales: tuple[float | None, ...] = (None,)
+) -> tuple[list[Image.Image], StageTimings]:
+    """
+    build_frame Decode, resize and combine the images of one frame, then quantize it once per output scale
+
+    Args:
+        `image_paths (Iterable[str | Path])`: Images placed side by side in the frame
+        `scales (tuple[float | None, ...])`: One resize factor per output GIF, `None` keeps the full size
+
+    Returns:
+        `tuple[list[Image.Image], StageTimings]`: Palette image for each scale and the time spent in each stage
+    """
+    timings: StageTimings = StageTimings(frames=1)
+
+    start_time: float = time.perf_counter()
+    images: list[Image.Image] = [
+        imio.load_image(image_path, FRAME_IMAGE_SIZE) for image_path in image_paths
     ]
+    timings.decode_resize = time.perf_counter() - start_time
 
-    resized_frames[0].save(
-        output_file,
-        save_all=True,
-        append_images=resized_frames[1:],
-        loop=0,
-        duration=im.info["duration"],
-    )
+    start_time = time.perf_counter()
+    frame: Image.Image = compose_images(images)
+    timings.compose = time.perf_counter() - start_time
+
+    start_time = time.perf_counter()
+    quantized_frames: list[Image.Image] = [
+        quantize_frame(frame, scale) for scale in scales
+    ]
+    timings.quantize = time.perf_counter() - start_time
+
+    return quantized_frames, timings
+
+
+def iter_frames(
+    frame_paths: Iterable[Iterable[str | Path]],
+    scales: tuple[float | None, ...] = (None,),
+    max_workers: int | None = None,
+    timings: StageTimings | None = None,
+) -> Iterator[list[Image.Image]]:
+    """
+    iter_frames Build frames in a process pool and yield them in order
+
+    At most two frames per worker are in flight, so finished frames wait in a bounded queue for
+    the encoder instead of piling up in memory.
+
+    Args:
+        `frame_paths (Iterable[Iterable[str | Path]])`: Image paths of each frame
+        `scales (tuple[float | None, ...])`: One resize factor per output GIF
+        `max_workers (int | None)`: Number of processes. Defaults to the number of cores
+        `timings (StageTimings | None)`: Accumulates the per-stage time reported by the workers
+
+    Yields:
+        `list[Image.Image]`: Palette image for each scale, in frame order
+    """
+    max_workers = max_workers or os.cpu_count() or 1
+    pending: deque[Future] = deque()
+
+    def next_frame() -> list[Image.Image]:
+        quantized_frames, frame_timings = pending.popleft().result()
+        if timings is not None:
+            timings.add(frame_timings)
+        return quantized_frames
+
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        for image_paths in frame_paths:
+            pending.append(executor.submit(build_frame, list(image_paths), scales))
+            if len(pending) >= 2 * max_workers:
+                yield next_frame()
+        while pending:
+            yield next_frame()
+
+
+class GifWriter:
+    """
+    GifWriter Write an animated GIF one frame at a time
+
+    Each frame is quantized and encoded as soon as it is added, so only the current frame is held
+    in memory. Pillow's `save(append_images=...)` needs every frame up front. Leaving the `with`
+    block on an exception deletes the partial file instead of finishing it with a trailer.
+
+    Args:
+        `output_file (str | Path)`: Destination GIF
+        `duration (int)`: Display time of each frame in milliseconds
+        `loop (int)`: Number of loops, 0 loops forever
+        `scale (float | None)`: Resize every frame by this factor before encoding
+    """
+
+    def __init__(
+        self,
+        output_file: str | Path,
+        duration: int = 1000,
+        loop: int = 0,
+        scale: float | None = None,
+    ) -> None:
+        self.duration: int = duration
+        self.loop: int = loop
+        self.scale: float | None = scale
+        self.n_frames: int = 0
+        self._fp: BinaryIO = open(output_file, "wb")
+
+    def add_frame(self, frame: Image.Image) -> None:
+        if self.scale or frame.mode != "P":
+            frame = quantize_frame(frame, self.scale)
+
+        # getheader and getdata are the helpers Pillow's own writer uses. They aren't part of the
+        # documented API, so environment.yml pins the Pillow version this was written against
+        if self.n_frames == 0:
+            header, _ = GifImagePlugin.getheader(
+                frame, info={"loop": self.loop, "duration": self.duration}
+            )
+            self._fp.write(b"".join(header))
+        # Every frame carries its own color table, like Pillow's multi-frame writer
+        for block in GifImagePlugin.getdata(
+            frame, duration=self.duration, include_color_table=True
+        ):
+            self._fp.write(block)
+        self.n_frames += 1
+
+    def close(self) -> None:
+        if self._fp.closed:
+            return
+        if self.n_frames == 0:
+            self.abort()
+            raise ValueError("Cannot write a GIF without frames")
+        self._fp.write(b";")  # GIF trailer
+        self._fp.close()
+
+    def abort(self) -> None:
+        # Delete the partial file so a truncated GIF never looks complete
+        self._fp.close()
+        Path(self._fp.name).unlink(missing_ok=True)
+
+    def __enter__(self) -> "GifWriter":
+        return self
+
+    def __exit__(
+        self,
+        exc_type: type[BaseException] | None,
+        exc: BaseException | None,
+        traceback: TracebackType | None,
+    ) -> None:
+        if exc_type is not None:
+            self.abort()
+        else:
+            self.close()
+
+
+def make_gif(
+    frame_folder: str | Path | None,
+    output_file: Path,
+    duration: int = 1000,
+    loop: int = 0,
+    compressed_output_file: Path | None = None,
+    compress_scale: float = 0.7,
+    max_workers: int | None = None,
+    frame_paths: Iterable[Iterable[str | Path]] | None = None,
+) -> StageTimings:
+    if frame_paths is None:
+        # Pair the files of an exported folder by filename, in chronological order
+        jpg_paths: dict[str, Path] = {
+            path.stem: path for path in Path(frame_folder).glob("*.jpg")
+        }
+        webp_paths: dict[str, Path] = {
+            path.stem: path for path in Path(frame_folder).glob("*.webp")
+        }
+        frame_paths = [
+            [jpg_paths[stem], webp_paths[stem]]
+            for stem in sorted(
+                jpg_paths.keys() & webp_paths.keys(),
+                key=lambda stem: tuple(int(part) for part in stem.split("_")),
+            )
+        ]
+
+    output_files: list[Path] = [output_file]
+    scales: list[float | None] = [None]
+    # Write the compressed copy in the same pass instead of decoding the full GIF again
+    if compressed_output_file is not None:
+        output_files.append(compressed_output_file)
+        scales.append(compress_scale)
+
+    timings: StageTimings = StageTimings()
+    start_time: float = time.perf_counter()
+    with ExitStack() as stack:
+        writers: list[GifWriter] = [
+            stack.enter_context(GifWriter(file, duration=duration, loop=loop))
+            for file in output_files
+        ]
+        for quantized_frames in iter_frames(
+            frame_paths, tuple(scales), max_workers=max_workers, timings=timings
+        ):
+            encode_start: float = time.perf_counter()
+            for writer, frame in zip(writers, quantized_frames):
+                writer.add_frame(frame)
+            timings.encode += time.perf_counter() - encode_start
+    timings.wall = time.perf_counter() - start_time
+
+    # The frames are built in worker processes, so record their timings here
+    mt.count("encode.frames", timings.frames)
+    for name in ("decode_resize", "compose", "quantize", "encode"):
+        mt.observe(f"encode.{name}", getattr(timings, name))
+
+    return timings
+
+
+def compress_gif(image: str | Path, output_file: Path, scale: float = 0.7):
+    with Image.open(image) as im, GifWriter(
+        output_file, duration=im.info["duration"], loop=0, scale=scale
+    ) as writer:
+        for frame in ImageSequence.Iterator(im):
+            writer.add_frame(frame)
@@ -1,34 +1,51 @@
+import argparse
 from pathlib import Path
 
 import gif_maker as gif_m
+import pixel_archive as pa
 
 
 def main():
-    og_image_list: list[str] = gif_m.get_filtered_images()
-    destination_path: Path = Path.cwd() / "data" / "processed" / "final-image-folder"
-
-    Path.mkdir(destination_path, exist_ok=True)
-
-    gif_m.transfer_files(source=og_image_list, destination_path=destination_path)
-
-    magazine_squares_filepath: Path = (
-        Path.cwd() / "data" / "processed" / "kmeans-squares"
+    parser = argparse.ArgumentParser(
+        description="Combine every cover with its KMeans square into a gif"
+    )
+    parser.add_argument(
+        "--export-folder",
+        choices=["copy", "hardlink", "symlink"],
+        help="Also place every frame source in data/processed/final-image-folder",
     )
-    gif_m.transfer_files(
-        source=magazine_squares_filepath, destination_path=destination_path
+    parser.add_argument(
+        "--archive",
+        action="store_true",
+        help="Read the covers that are in the pixel archive from it, at its working size",
     )
+    args = parser.parse_args()
+
+    frame_paths: list[tuple[Path | pa.ArchiveEntry, Path]] = gif_m.get_frame_paths()
+
+    if args.export_folder:
+        gif_m.export_frame_folder(
+            frame_paths,
+            Path.cwd() / "data" / "processed" / "final-image-folder",
+            mode=args.export_folder,
+        )
 
     final_img_filepath: Path = (
         Path.cwd() / "reports" / "figures" / "magazine-covers.gif"
     )
-    gif_m.make_gif(frame_folder=destination_path, output_file=final_img_filepath)
-
     compressed_final_img_filepath: Path = (
         Path.cwd() / "reports" / "figures" / "compressed-magazine-covers.gif"
     )
-    gif_m.compress_gif(
-        image=final_img_filepath, output_file=compressed_final_img_filepath
+    # Archived covers are animated at the working size, so only read them when asked
+    if args.archive:
+        frame_paths = pa.archive_frame_paths(frame_paths)
+    timings: gif_m.StageTimings = gif_m.make_gif(
+        frame_folder=None,
+        output_file=final_img_filepath,
+        compressed_output_file=compressed_final_img_filepath,
+        frame_paths=frame_paths,
     )
+    print(timings)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,14 @@
+from pathlib import Path
+
+import color_index as cx
+import pytest
+
+
+@pytest.mark.parametrize("make_folder", [True, False])
+def test_from_store_without_palettes(tmp_path: Path, make_folder: bool) -> None:
+    folder: Path = tmp_path / "palettes"
+    if make_folder:
+        folder.mkdir()
+
+    with pytest.raises(ValueError, match="No palettes fitted"):
+        cx.ColorIndex.from_store(folder)
@@ -0,0 +1,219 @@
+import asyncio
+import hashlib
+import threading
+import time
+from collections.abc import Iterator
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+import gather_magazines as gm
+import httpx
+import polars as pl
+import pytest
+
+ETAG: str = '"cover-v1"'
+
+
+class CoverServer(ThreadingHTTPServer):
+    """
+    CoverServer Local stand-in for the image host that records every request
+
+    Args:
+        `files (dict[str, bytes])`: Body served for each path
+        `delay (float)`: Seconds each request is held before its body is sent
+    """
+
+    def __init__(self, files: dict[str, bytes], delay: float = 0.0) -> None:
+        super().__init__(("127.0.0.1", 0), CoverHandler)
+        self.files: dict[str, bytes] = files
+        self.delay: float = delay
+        # Status codes returned, in order, before a path is served
+        self.failures: dict[str, list[int]] = {}
+        self.requests: list[tuple[str, dict[str, str], float]] = []
+        self.active: int = 0
+        self.max_active: int = 0
+        self.lock: threading.Lock = threading.Lock()
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self.server_address[1]}"
+
+
+class CoverHandler(BaseHTTPRequestHandler):
+    server: CoverServer
+
+    def log_message(self, *args) -> None:
+        pass
+
+    def do_GET(self) -> None:
+        server: CoverServer = self.server
+        with server.lock:
+            server.requests.append((self.path, dict(self.headers), time.monotonic()))
+            server.active += 1
+            server.max_active = max(server.max_active, server.active)
+        time.sleep(server.delay)
+        # Stop counting before the body is sent, so the client can't start another request first
+        with server.lock:
+            server.active -= 1
+            failures: list[int] = server.failures.get(self.path, [])
+            status: int | None = failures.pop(0) if failures else None
+
+        body: bytes = server.files.get(self.path, b"")
+        if status is None and self.path not in server.files:
+            status = 404
+        if status is not None:
+            self.send_response(status)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+
+        range_header: str | None = self.headers.get("Range")
+        if range_header and self.headers.get("If-Range") == ETAG:
+            start: int = int(range_header.removeprefix("bytes=").split("-")[0])
+            self.send_response(206)
+            self.send_header("Content-Range", f"bytes {start}-{len(body) - 1}/{len(body)}")
+            body = body[start:]
+        else:
+            self.send_response(200)
+        self.send_header("ETag", ETAG)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+def cover_bytes(seed: int, size: int = 200_000) -> bytes:
+    return (bytes(range(256)) * (size // 256 + 2))[seed % 256 : seed % 256 + size]
+
+
+@pytest.fixture
+def serve() -> Iterator:
+    servers: list[CoverServer] = []
+
+    def start(files: dict[str, bytes], delay: float = 0.0) -> CoverServer:
+        server: CoverServer = CoverServer(files, delay)
+        threading.Thread(
+            target=server.serve_forever, kwargs={"poll_interval": 0.01}, daemon=True
+        ).start()
+        servers.append(server)
+        return server
+
+    yield start
+    for server in servers:
+        server.shutdown()
+        server.server_close()
+
+
+async def fetch(server: CoverServer, path: str, filename: Path, **kwargs) -> int | None:
+    async with httpx.AsyncClient() as client:
+        return await gm.download_file(
+            client, server.url + path, filename, gm.HostRateLimiter(), **kwargs
+        )
+
+
+def test_download_images_bounds_concurrency(serve, tmp_path: Path) -> None:
+    files: dict[str, bytes] = {f"/covers/{i}.jpg": cover_bytes(i) for i in range(12)}
+    server: CoverServer = serve(files, delay=0.05)
+    df: pl.DataFrame = pl.DataFrame(
+        {
+            "cleaned_link": [server.url + path for path in files],
+            "filename": [str(i) for i in range(12)],
+        }
+    )
+
+    async def download() -> gm.DownloadSummary:
+        async with httpx.AsyncClient() as client:
+            return await gm.download_images(df, client, filepath=tmp_path, max_concurrency=3)
+
+    summary: gm.DownloadSummary = asyncio.run(download())
+
+    assert summary.files == 12 and summary.failed == 0
+    assert server.max_active == 3
+    for i, body in enumerate(files.values()):
+        assert (tmp_path / f"{i}.jpg").read_bytes() == body
+
+
+def test_download_images_batches_manifest_saves(
+    serve, tmp_path: Path, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    files: dict[str, bytes] = {f"/covers/{i}.jpg": cover_bytes(i, 1000) for i in range(4)}
+    server: CoverServer = serve(files)
+    df: pl.DataFrame = pl.DataFrame(
+        {
+            "cleaned_link": [server.url + path for path in files],
+            "filename": [str(i) for i in range(4)],
+        }
+    )
+    saves: list[int] = []
+    save = gm.DownloadManifest.save
+    monkeypatch.setattr(
+        gm.DownloadManifest,
+        "save",
+        lambda manifest: (saves.append(len(manifest.entries)), save(manifest)),
+    )
+
+    async def download() -> gm.DownloadSummary:
+        async with httpx.AsyncClient() as client:
+            return await gm.download_images(df, client, filepath=tmp_path)
+
+    asyncio.run(download())
+
+    # Two updates per file, written out once at the end
+    assert saves == [4]
+    manifest: gm.DownloadManifest = gm.DownloadManifest(tmp_path / gm.MANIFEST_FILENAME)
+    for i, path in enumerate(files):
+        assert manifest.is_current(server.url + path, tmp_path / f"{i}.jpg")
+
+
+@pytest.mark.parametrize("status", [429, 503])
+def test_download_file_retries_with_backoff(serve, tmp_path: Path, status: int) -> None:
+    server: CoverServer = serve({"/cover.jpg": cover_bytes(0)})
+    server.failures["/cover.jpg"] = [status, status]
+    backoff: float = 0.05
+
+    n_bytes: int | None = asyncio.run(
+        fetch(server, "/cover.jpg", tmp_path / "cover.jpg", backoff=backoff)
+    )
+
+    assert n_bytes == len(cover_bytes(0))
+    assert (tmp_path / "cover.jpg").read_bytes() == cover_bytes(0)
+    times: list[float] = [request_time for _, _, request_time in server.requests]
+    assert len(times) == 3
+    # Each retry waits at least the doubled base delay
+    for attempt, (before, after) in enumerate(zip(times, times[1:])):
+        assert after - before >= backoff * 2**attempt
+
+
+def test_download_file_gives_up_on_client_errors(serve, tmp_path: Path) -> None:
+    server: CoverServer = serve({})
+
+    with pytest.raises(httpx.HTTPStatusError):
+        asyncio.run(fetch(server, "/missing.jpg", tmp_path / "missing.jpg", backoff=0.01))
+
+    assert len(server.requests) == 1
+    assert not (tmp_path / "missing.jpg").exists()
+
+
+@pytest.mark.parametrize("etag, resumed", [(ETAG, True), ('"cover-v0"', False)])
+def test_download_file_resumes_partial_file(
+    serve, tmp_path: Path, etag: str, resumed: bool
+) -> None:
+    body: bytes = cover_bytes(0)
+    server: CoverServer = serve({"/cover.jpg": body})
+    filename: Path = tmp_path / "cover.jpg"
+    offset: int = 120_000
+    filename.with_name("cover.jpg.part").write_bytes(body[:offset])
+    manifest: gm.DownloadManifest = gm.DownloadManifest(tmp_path / gm.MANIFEST_FILENAME)
+    manifest.update(server.url + "/cover.jpg", gm.ManifestEntry("cover.jpg", etag=etag))
+
+    n_bytes: int | None = asyncio.run(
+        fetch(server, "/cover.jpg", filename, manifest=manifest)
+    )
+
+    # A partial file from another version of the cover is downloaded again from the start
+    assert server.requests[0][1]["Range"] == f"bytes={offset}-"
+    assert n_bytes == (len(body) - offset if resumed else len(body))
+    assert filename.read_bytes() == body
+    assert not filename.with_name("cover.jpg.part").exists()
+    entry: gm.ManifestEntry = manifest.get(server.url + "/cover.jpg")
+    assert entry.complete and entry.size == len(body)
+    assert entry.sha256 == hashlib.sha256(body).hexdigest()
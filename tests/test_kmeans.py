@@ -0,0 +1,53 @@
+import warnings
+from collections import Counter
+from pathlib import Path
+
+import kmeans as km
+import numpy as np
+import pytest
+from PIL import Image
+
+COLORS: list[list[int]] = [[200, 30, 40], [10, 200, 90]]
+
+
+@pytest.fixture
+def two_color_image(tmp_path: Path) -> Path:
+    image_array: np.ndarray = np.zeros((40, 30, 3), dtype=np.uint8)
+    image_array[:25] = COLORS[0]
+    image_array[25:] = COLORS[1]
+    filepath: Path = tmp_path / "two-colors.png"
+    Image.fromarray(image_array).save(filepath)
+    return filepath
+
+
+@pytest.mark.parametrize("engine", km.ENGINES)
+def test_kmeans_img_with_fewer_colors_than_clusters(
+    two_color_image: Path, engine: str
+) -> None:
+    with warnings.catch_warnings():
+        # scikit-learn warns that it found fewer distinct clusters than requested
+        warnings.simplefilter("ignore")
+        color_palette, color_labels = km.kmeans_img(
+            two_color_image, n_clusters=5, random_state=0, engine=engine
+        )
+
+    ranked_palette: np.ndarray = km.rank_palette(color_palette, color_labels)
+    assert color_palette.shape == (5, 3)
+    assert np.allclose(ranked_palette["color"], COLORS, atol=0.5)
+    assert ranked_palette["count"].tolist() == [750, 450]
+
+
+def test_kmeans_colors_pads_the_centroids(two_color_image: Path) -> None:
+    centroids, labels, counts = km.kmeans_colors(two_color_image, n_clusters=5)
+
+    assert centroids.shape == (5, 3)
+    assert sorted(km.rank_palette(centroids, labels, counts)["count"]) == [450, 750]
+
+
+def test_tied_clusters_keep_first_appearance_order() -> None:
+    color_labels: np.ndarray = np.array([3, 1, 1, 3, 0, 2, 2, 0, 4])
+    expected: list[int] = [label for label, _ in Counter(color_labels.tolist()).most_common()]
+
+    ranked_palette: np.ndarray = km.rank_palette(np.zeros((5, 3)), color_labels)
+    assert ranked_palette["label"].tolist() == expected
+    assert km.get_color_labels(color_labels, color_indices=(0, 1, 2, 3)) == expected[:4]
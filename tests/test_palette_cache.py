@@ -0,0 +1,54 @@
+from pathlib import Path
+
+import numpy as np
+import palette_cache as pc
+import pytest
+from PIL import Image
+
+KMEANS_PARAMS: dict = {"n_clusters": 3, "random_state": 0}
+
+
+@pytest.fixture
+def covers(tmp_path: Path) -> list[Path]:
+    rng: np.random.Generator = np.random.default_rng(0)
+    filepaths: list[Path] = []
+    for i in range(5):
+        image_array: np.ndarray = rng.integers(0, 256, (24, 18, 3), dtype=np.uint8)
+        filepath: Path = tmp_path / f"{i}.png"
+        Image.fromarray(image_array).save(filepath)
+        filepaths.append(filepath)
+    return filepaths
+
+
+def ranked_palettes(covers: list[Path], cache: pc.PaletteCache) -> dict[Path, np.ndarray]:
+    return {
+        filepath: ranked_palette
+        for filepath, _, ranked_palette, _ in pc.cached_palettes(
+            covers, cache, max_workers=2, warm_start=True, **KMEANS_PARAMS
+        )
+    }
+
+
+def test_warm_start_palettes_do_not_depend_on_cached_neighbors(
+    tmp_path: Path, covers: list[Path]
+) -> None:
+    cache: pc.PaletteCache = pc.PaletteCache(tmp_path / "cache")
+    expected: dict[Path, np.ndarray] = ranked_palettes(covers, cache)
+
+    # Drop every other cover, so the refits start from cached neighbors
+    for entry in cache.folder.glob("*.npy"):
+        if any(np.array_equal(np.load(entry), expected[filepath]) for filepath in covers[1::2]):
+            entry.unlink()
+    palettes: dict[Path, np.ndarray] = ranked_palettes(covers, cache)
+
+    for filepath in covers:
+        np.testing.assert_array_equal(palettes[filepath], expected[filepath])
+
+
+def test_warm_start_keys_chain_within_a_run(covers: list[Path], tmp_path: Path) -> None:
+    cache: pc.PaletteCache = pc.PaletteCache(tmp_path / "cache")
+    ranked_palettes(covers, cache)
+    ranked_palettes(covers[1:], cache)
+
+    # Without its predecessor, the second cover starts a run and is fitted again under a new key
+    assert len(list(cache.folder.glob("*.npy"))) == len(covers) + len(covers) - 1
@@ -0,0 +1,155 @@
+import asyncio
+import functools
+import threading
+from collections.abc import Iterator
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from urllib.parse import parse_qs, urlsplit
+
+import gather_magazines as gm
+import httpx
+import pytest
+import scrapers
+
+FIXTURES: Path = Path(__file__).parent / "fixtures"
+IMAGE_URL: str = "https://res.cloudinary.com/hksqkdlah/image/upload/ar_1:1,c_fill,dpr_2.0,f_auto,fl_lossy.progressive,q_auto:low,w_268/"
+# Cards of listing-page-1.html and listing-page-2.html, newest first
+EXPECTED: list[gm.Magazine] = [
+    gm.Magazine(name, IMAGE_URL + slug)
+    for name, slug in [
+        ("May/June 2024", "CIO-MayJune-2024"),
+        ("March/April 2024", "CIO-MarApr-2024"),
+        ("January/February 2024", "CIO-JanFeb-2024"),
+        ("November/December 2023", "CIO-NovDec-2023"),
+        ("September/October 2023", "CIO-SepOct-2023"),
+    ]
+]
+
+
+class ListingServer(ThreadingHTTPServer):
+    """
+    ListingServer Serve the saved listing pages
+
+    `/magazines?page=N` returns `listing-page-N.html`, or 404 past the last saved page, and
+    `/magazines` returns the single page with a "load more" button.
+
+    Args:
+        `ignore_page (bool)`: Always return the first page, like a site without the page parameter
+    """
+
+    def __init__(self, ignore_page: bool = False) -> None:
+        super().__init__(("127.0.0.1", 0), ListingHandler)
+        self.ignore_page: bool = ignore_page
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self.server_address[1]}/magazines"
+
+
+class ListingHandler(BaseHTTPRequestHandler):
+    server: ListingServer
+
+    def log_message(self, *args) -> None:
+        pass
+
+    def do_GET(self) -> None:
+        query: dict[str, list[str]] = parse_qs(urlsplit(self.path).query)
+        if "page" not in query:
+            fixture: Path = FIXTURES / "listing-load-more.html"
+        else:
+            page: str = "1" if self.server.ignore_page else query["page"][0]
+            fixture = FIXTURES / f"listing-page-{page}.html"
+        if not fixture.exists():
+            self.send_error(404)
+            return
+        body: bytes = fixture.read_bytes()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/html; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+@pytest.fixture
+def serve() -> Iterator:
+    servers: list[ListingServer] = []
+
+    def start(ignore_page: bool = False) -> ListingServer:
+        server: ListingServer = ListingServer(ignore_page)
+        threading.Thread(
+            target=server.serve_forever, kwargs={"poll_interval": 0.01}, daemon=True
+        ).start()
+        servers.append(server)
+        return server
+
+    yield start
+    for server in servers:
+        server.shutdown()
+        server.server_close()
+
+
+async def scrape_httpx(server: ListingServer, **kwargs) -> list[gm.Magazine]:
+    async with httpx.AsyncClient() as client:
+        return await scrapers.HttpxScraper(
+            client, page_url=server.url + "?page={page}", concurrency=2
+        ).scrape(**kwargs)
+
+
+def test_httpx_scraper_reads_every_page(serve) -> None:
+    assert asyncio.run(scrape_httpx(serve())) == EXPECTED
+
+
+def test_httpx_scraper_stops_at_a_stored_issue(serve) -> None:
+    results: list[gm.Magazine] = asyncio.run(
+        scrape_httpx(serve(), known_names={"January/February 2024"})
+    )
+
+    assert results == EXPECTED[:3]
+
+
+def test_httpx_scraper_detects_an_ignored_page_parameter(serve) -> None:
+    with pytest.raises(scrapers.PaginationError):
+        asyncio.run(scrape_httpx(serve(ignore_page=True)))
+
+
+def test_scrape_with_fallback_uses_playwright_when_pagination_fails(
+    serve, monkeypatch
+) -> None:
+    server: ListingServer = serve(ignore_page=True)
+    monkeypatch.setattr(
+        scrapers,
+        "HttpxScraper",
+        functools.partial(scrapers.HttpxScraper, page_url=server.url + "?page={page}"),
+    )
+
+    async def playwright_scrape(self, known_names=None) -> list[gm.Magazine]:
+        return EXPECTED
+
+    monkeypatch.setattr(scrapers.PlaywrightScraper, "scrape", playwright_scrape)
+
+    async def scrape() -> list[gm.Magazine]:
+        async with httpx.AsyncClient() as client:
+            return await scrapers.scrape_with_fallback(client)
+
+    assert asyncio.run(scrape()) == EXPECTED
+
+
+def test_backends_parse_the_same_cards(serve) -> None:
+    async_api = pytest.importorskip("playwright.async_api")
+
+    async def launch() -> None:
+        async with async_api.async_playwright() as p:
+            browser = await p.chromium.launch()
+            await browser.close()
+
+    try:
+        asyncio.run(launch())
+    except async_api.Error as exc:
+        pytest.skip(f"Chromium is not available: {str(exc).splitlines()[0]}")
+
+    server: ListingServer = serve()
+    browser_results: list[gm.Magazine] = asyncio.run(
+        scrapers.PlaywrightScraper(base_url=server.url).scrape()
+    )
+
+    assert browser_results == asyncio.run(scrape_httpx(server)) == EXPECTED
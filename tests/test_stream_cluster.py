@@ -0,0 +1,62 @@
+import asyncio
+import io
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import httpx
+import numpy as np
+import palette_cache as pc
+import polars as pl
+import stream_cluster as sc
+from PIL import Image
+
+
+def png_bytes(color: tuple[int, int, int]) -> bytes:
+    image_array: np.ndarray = np.zeros((20, 16, 3), dtype=np.uint8)
+    image_array[:10] = color
+    buffer: io.BytesIO = io.BytesIO()
+    Image.fromarray(image_array).save(buffer, format="PNG")
+    return buffer.getvalue()
+
+
+class FailingCache(pc.PaletteCache):
+    def put(self, key: str, ranked_palette: np.ndarray) -> None:
+        raise OSError("disk full")
+
+
+def test_download_and_cluster_survives_cache_errors(tmp_path: Path) -> None:
+    covers: dict[str, bytes] = {
+        f"/covers/{i}.png": png_bytes((40 * i, 200, 90)) for i in range(6)
+    }
+    transport: httpx.MockTransport = httpx.MockTransport(
+        lambda request: httpx.Response(200, content=covers[request.url.path])
+    )
+    df: pl.DataFrame = pl.DataFrame(
+        {
+            "cleaned_link": [f"https://covers.test{path}" for path in covers],
+            "filename": [str(i) for i in range(6)],
+        }
+    )
+
+    async def run() -> tuple:
+        async with httpx.AsyncClient(transport=transport) as client:
+            with ThreadPoolExecutor(max_workers=2) as executor:
+                # With one consumer and a one-item queue, a dead consumer would stall the downloads
+                return await asyncio.wait_for(
+                    sc.download_and_cluster(
+                        df,
+                        client,
+                        executor,
+                        {"n_clusters": 2, "random_state": 0},
+                        filepath=tmp_path,
+                        cache=FailingCache(tmp_path / "cache"),
+                        queue_size=1,
+                        n_consumers=1,
+                    ),
+                    timeout=30,
+                )
+
+    summary, palettes = asyncio.run(run())
+
+    assert summary.files == 6
+    assert palettes == {}